@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
+from app.core.security import PasswordHasherOverloaded
 from app.schemas.user import UserCreate, UserResponse, UserLogin, Token
 from app.services.auth_service import AuthService
 from app.api.dependencies import get_current_user
@@ -9,27 +12,43 @@ from app.models.user import User
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 
+def _hashing_overloaded() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is temporarily overloaded, please retry",
+        headers={"Retry-After": str(settings.password_hash_retry_after_seconds)},
+    )
+
+
 @router.post("/register", response_model=UserResponse)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user already exists
-    if AuthService.get_user_by_username(db, user.username):
+    if await AuthService.get_user_by_username_async(db, user.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
-    if AuthService.get_user_by_email(db, user.email):
+    if await AuthService.get_user_by_email_async(db, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    return AuthService.create_user(db, user)
+    try:
+        return await AuthService.create_user_async(db, user)
+    except PasswordHasherOverloaded:
+        raise _hashing_overloaded()
 
 
 @router.post("/login", response_model=Token)
-def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
-    user = AuthService.authenticate_user(db, user_credentials.username, user_credentials.password)
+async def login_user(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    try:
+        user = await AuthService.authenticate_user_async(
+            db, user_credentials.username, user_credentials.password
+        )
+    except PasswordHasherOverloaded:
+        raise _hashing_overloaded()
     
     if not user:
         raise HTTPException(
@@ -1,20 +1,22 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
+from app.core.rate_limit import InFlightLimiter, TokenBucketLimiter, in_flight_limiters, retry_after
 from app.core.security import verify_token
 from app.services.auth_service import AuthService
 from app.models.user import User
 
 security = HTTPBearer()
 
+# Per-user message budget, also charged by the WebSocket loop
+send_limiter = TokenBucketLimiter(settings.send_rate_per_second, settings.send_burst)
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    token = credentials.credentials
-    user_id = verify_token(token)
+
+def _token_user_id(credentials: HTTPAuthorizationCredentials) -> int:
+    user_id = verify_token(credentials.credentials)
     
     if user_id is None:
         raise HTTPException(
@@ -23,11 +25,86 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = AuthService.get_user_by_id(db, int(user_id))
+    return int(user_id)
+
+
+def _require_user(user: User) -> User:
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
     
-    return user
\ No newline at end of file
+    if user.is_active is False:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Inactive user"
+        )
+    
+    return user
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> User:
+    return _require_user(AuthService.get_user_by_id_cached(db, _token_user_id(credentials)))
+
+
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """get_current_user for async routes, so the lookup doesn't block the event loop"""
+    return _require_user(await AuthService.get_user_by_id_cached_async(db, _token_user_id(credentials)))
+
+
+def _charge_send(user: User) -> User:
+    wait = send_limiter.acquire(user.id)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many messages, slow down",
+            headers={"Retry-After": str(retry_after(wait))},
+        )
+    return user
+
+
+def too_many_receipts() -> HTTPException:
+    # Raised for TooManyPendingReceipts; the pending set empties every flush
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many pending receipts, slow down",
+        headers={"Retry-After": "1"},
+    )
+
+
+def get_rate_limited_sender(current_user: User = Depends(get_current_user)) -> User:
+    """get_current_user that also charges the user's send budget"""
+    return _charge_send(current_user)
+
+
+async def get_rate_limited_sender_async(current_user: User = Depends(get_current_user_async)) -> User:
+    return _charge_send(current_user)
+
+
+def limit_in_flight(name: str, limit: int):
+    """Route dependency that sheds requests with 503 once `limit` are in flight.
+
+    Used via `dependencies=[...]` so it runs before auth or any DB work.
+    """
+    limiter = in_flight_limiters[name] = InFlightLimiter(limit)
+    
+    async def dependency():
+        if not limiter.try_enter():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            yield
+        finally:
+            limiter.exit()
+    
+    return dependency
@@ -1,26 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.core.database import get_db
-from app.schemas.message import MessageCreate, MessageResponse
-from app.services.message_service import MessageService
-from app.api.dependencies import get_current_user
+from app.core.database import get_db, get_async_db
+from app.core.pagination import encode_cursor, decode_cursor
+from app.schemas.message import MessageCreate, MessageResponse, MessagePage, SearchPage
+from app.schemas.conversation import ConversationResponse, InboxPage
+from app.services.message_service import MessageService, FileTooLargeError
+from app.services.conversation_service import ConversationService
+from app.services.search_service import SearchService
+from app.services.receipt_writer import receipt_writer, LATEST, TooManyPendingReceipts
+from app.services.thumbnail_service import (
+    thumbnail_cache,
+    SourceImageTooLarge,
+    THUMBNAIL_FORMATS,
+    MAX_DIMENSION,
+)
+from app.api.dependencies import (
+    get_current_user,
+    get_current_user_async,
+    get_rate_limited_sender,
+    get_rate_limited_sender_async,
+    limit_in_flight,
+    too_many_receipts,
+)
+from app.services.auth_service import AuthService
 from app.models.user import User
-from app.models.message import MessageType, Message
+from app.models.message import MessageType
 from app.core.config import settings
+from app.core.serialization import JSONBytesResponse
+from app.core.security import verify_media_signature
+from app.services.media_service import signed_media_url, resolve_media_path
+from email.utils import formatdate, parsedate_to_datetime
+from concurrent.futures.process import BrokenProcessPool
 import os
+import re
+import time
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
+_CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
 
-@router.post("/send", response_model=MessageResponse)
+
+def _message_item(row, media_urls: bool = True) -> dict:
+    """MessageResponse as a plain dict (same keys and order) for list endpoints,
+    which return JSONBytesResponse instead of validating ORM objects"""
+    image_url = thumbnail_url = None
+    if media_urls and row.message_type == MessageType.IMAGE and row.file_url:
+        # Signed URLs let clients fetch media without auth or DB work on our side
+        size = settings.thumbnail_default_size
+        fallback_url = f"{settings.public_base_url}/messages/image/{row.id}"
+        image_url = signed_media_url(row.file_url) or fallback_url
+        thumbnail_url = (
+            signed_media_url(row.file_url, w=size, h=size, format="webp")
+            or f"{fallback_url}?w={size}&h={size}&format=webp"
+        )
+    return {
+        "receiver_id": row.receiver_id,
+        "content": row.content,
+        "message_type": row.message_type,
+        "id": row.id,
+        "sender_id": row.sender_id,
+        "file_url": row.file_url,
+        "image_url": image_url,
+        "thumbnail_url": thumbnail_url,
+        "created_at": row.created_at,
+    }
+
+
+@router.post(
+    "/send",
+    response_model=MessageResponse,
+    dependencies=[Depends(limit_in_flight("send", settings.send_max_in_flight))]
+)
 def send_message(
     message: MessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_rate_limited_sender),
     db: Session = Depends(get_db)
 ):
     # Verify receiver exists
-    receiver = db.query(User).filter(User.id == message.receiver_id).first()
+    receiver = AuthService.get_user_by_id_cached(db, message.receiver_id)
     if not receiver:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -30,16 +90,20 @@ def send_message(
     return MessageService.create_message(db, message, current_user.id)
 
 
-@router.post("/send-image", response_model=MessageResponse)
+@router.post(
+    "/send-image",
+    response_model=MessageResponse,
+    dependencies=[Depends(limit_in_flight("send-image", settings.upload_max_in_flight))]
+)
 async def send_image_message(
     receiver_id: int = Form(...),
     caption: Optional[str] = Form(None),
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_rate_limited_sender_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verify receiver exists
-    receiver = db.query(User).filter(User.id == receiver_id).first()
+    receiver = await AuthService.get_user_by_id_cached_async(db, receiver_id)
     if not receiver:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -53,30 +117,37 @@ async def send_image_message(
             detail="File must be an image"
         )
     
-    # Check file size
-    file_size = 0
-    content = await file.read()
-    file_size = len(content)
-    await file.seek(0)  # Reset file pointer
-    
-    if file_size > settings.max_file_size:
+    # Reject early when the client declared an oversized upload
+    if file.size is not None and file.size > settings.max_file_size:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"File size exceeds {settings.max_file_size} bytes"
         )
     
-    # Save file
-    file_path = await MessageService.save_uploaded_file(file, settings.upload_dir)
+    # Save file, enforcing the size limit while streaming
+    try:
+        media = await MessageService.save_uploaded_file(
+            file, settings.upload_dir, settings.max_file_size, db
+        )
+    except FileTooLargeError:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds {settings.max_file_size} bytes"
+        )
     
     # Create message
-    return MessageService.create_media_message(
-        db, current_user.id, receiver_id, file_path, MessageType.IMAGE, caption
+    return await MessageService.create_media_message_async(
+        db, current_user.id, receiver_id, media, MessageType.IMAGE, caption
     )
 
 
-@router.get("/conversation/{user_id}", response_model=List[MessageResponse])
+@router.get("/conversation/{user_id}", response_model=MessagePage)
 def get_conversation(
     user_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -88,14 +159,159 @@ def get_conversation(
             detail="User not found"
         )
     
-    messages = MessageService.get_messages_between_users(db, current_user.id, user_id)
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+            before_id = position.get("before")
+            after_id = position.get("after")
+            if not all(v is None or isinstance(v, int) for v in (before_id, after_id)):
+                raise ValueError("Invalid cursor")
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    if before_id is not None and after_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before_id or after_id, not both"
+        )
+    
+    rows, has_more = MessageService.get_conversation_rows(
+        db, current_user.id, user_id, limit, before_id=before_id, after_id=after_id
+    )
+    
+    before_cursor = None
+    after_cursor = encode_cursor({"after": after_id}) if after_id is not None else None
+    if rows:
+        if has_more or after_id is not None:
+            before_cursor = encode_cursor({"before": rows[0].id})
+        after_cursor = encode_cursor({"after": rows[-1].id})
     
-    # Add full image URLs for image messages
-    for message in messages:
-        if message.message_type == MessageType.IMAGE and message.file_url:
-            message.image_url = f"http://localhost:8000/messages/image/{message.id}"
+    return JSONBytesResponse({
+        "items": [_message_item(row) for row in rows],
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor
+    })
+
+
+@router.post("/conversation/{user_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_conversation_read(
+    user_id: int,
+    up_to_id: Optional[int] = Query(None, ge=1),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Move the caller's read mark to `up_to_id` (default: the newest message).
+    Returns once the receipt is stored; both participants are notified over WebSocket"""
+    try:
+        await receipt_writer.mark(current_user.id, user_id, read_id=up_to_id or LATEST, wait=True)
+    except TooManyPendingReceipts:
+        raise too_many_receipts()
+
+
+@router.post("/conversation/{user_id}/delivered", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_conversation_delivered(
+    user_id: int,
+    up_to_id: int = Query(..., ge=1),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Move the caller's delivered mark to `up_to_id`"""
+    try:
+        await receipt_writer.mark(current_user.id, user_id, delivered_id=up_to_id, wait=True)
+    except TooManyPendingReceipts:
+        raise too_many_receipts()
+
+
+@router.get("/inbox", response_model=InboxPage)
+def get_inbox(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    before_message_id = None
+    if cursor:
+        try:
+            before_message_id = decode_cursor(cursor).get("before")
+            if not isinstance(before_message_id, int):
+                raise ValueError("Invalid cursor")
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
     
-    return messages
+    conversations, has_more = ConversationService.get_inbox_page(
+        db, current_user.id, limit, before_message_id=before_message_id
+    )
+    
+    items = []
+    for conversation in conversations:
+        is_low = conversation.user_low_id == current_user.id
+        items.append(ConversationResponse(
+            id=conversation.id,
+            other_user_id=conversation.user_high_id if is_low else conversation.user_low_id,
+            last_message_id=conversation.last_message_id,
+            last_sender_id=conversation.last_sender_id,
+            last_message_type=conversation.last_message_type,
+            last_message_preview=conversation.last_message_preview,
+            last_message_at=conversation.last_message_at,
+            unread_count=conversation.unread_low if is_low else conversation.unread_high,
+            read_up_to_id=conversation.read_low_id if is_low else conversation.read_high_id,
+            other_read_up_to_id=conversation.read_high_id if is_low else conversation.read_low_id,
+            other_delivered_up_to_id=(
+                conversation.delivered_high_id if is_low else conversation.delivered_low_id
+            )
+        ))
+    
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor({"before": conversations[-1].last_message_id})
+    
+    return InboxPage(items=items, next_cursor=next_cursor)
+
+
+@router.get(
+    "/search",
+    response_model=SearchPage,
+    dependencies=[Depends(limit_in_flight("search", settings.search_max_in_flight))]
+)
+def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over the caller's conversations, best matches first"""
+    offset = 0
+    if cursor:
+        try:
+            offset = int(decode_cursor(cursor)["offset"])
+            if offset < 0:
+                raise ValueError("Invalid cursor")
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    rows, has_more = SearchService.search(
+        db, current_user.id, q, limit, offset=offset, max_results=settings.search_max_results
+    )
+    
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor({"offset": offset + len(rows)})
+    
+    items = []
+    for row in rows:
+        item = _message_item(row)
+        item["score"] = row.score
+        item["highlight"] = row.highlight
+        items.append(item)
+    return JSONBytesResponse({"items": items, "next_cursor": next_cursor})
 
 
 @router.get("/my-messages", response_model=List[MessageResponse])
@@ -103,20 +319,88 @@ def get_my_messages(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    return MessageService.get_user_messages(db, current_user.id)
+    rows = MessageService.get_user_message_rows(db, current_user.id)
+    return JSONBytesResponse([_message_item(row, media_urls=False) for row in rows])
+
+
+def _is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _file_response(request: Request, path: str, cache_control: str, media_type: Optional[str] = None):
+    """FileResponse with validators; answers conditional requests with 304.
+    Byte ranges (Range/If-Range) are handled by FileResponse itself."""
+    stat_result = os.stat(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _CONTENT_HASH.match(stem):
+        # Content-addressed files never change, so the hash is a strong validator
+        etag = f'"{stem}"'
+    else:
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+    
+    if _is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+async def _image_response(
+    request: Request,
+    source_path: str,
+    cache_control: str,
+    w: Optional[int],
+    h: Optional[int],
+    image_format: Optional[str]
+):
+    if w is None and h is None and image_format is None:
+        return _file_response(request, source_path, cache_control)
+    
+    # Resized/converted derivative, rendered once and served from the disk cache
+    fmt = image_format or "webp"
+    try:
+        thumbnail_path = await thumbnail_cache.get(source_path, w, h, fmt)
+    except SourceImageTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Image is too large to resize"
+        )
+    except (OSError, BrokenProcessPool):
+        # Unreadable, or it crashed the render worker
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Image could not be resized"
+        )
+    return _file_response(request, thumbnail_path, cache_control, THUMBNAIL_FORMATS[fmt][2])
 
 
 @router.get("/image/{message_id}")
 async def get_message_image(
+    request: Request,
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    w: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    image_format: Optional[str] = Query(None, alias="format", pattern="^(webp|jpeg|png)$"),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get image file for a specific message"""
-    from fastapi.responses import FileResponse
-    
     # Get the message
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await MessageService.get_message_by_id_async(db, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -144,4 +428,35 @@ async def get_message_image(
             detail="Image file not found"
         )
     
-    return FileResponse(message.file_url)
\ No newline at end of file
+    cache_control = f"private, max-age={settings.media_url_ttl_seconds}"
+    return await _image_response(request, message.file_url, cache_control, w, h, image_format)
+
+
+@router.get("/media/{path:path}")
+async def get_signed_media(
+    request: Request,
+    path: str,
+    exp: int,
+    sig: str,
+    w: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    image_format: Optional[str] = Query(None, alias="format", pattern="^(webp|jpeg|png)$")
+):
+    """Serve media from a signed URL issued with a conversation; no auth or DB lookup"""
+    if not verify_media_signature(path, exp, sig):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired media URL"
+        )
+    
+    file_path = resolve_media_path(path)
+    if file_path is None or not os.path.isfile(file_path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Media file not found"
+        )
+    
+    # The URL itself is the capability, so shared caches may keep it until it expires
+    max_age = max(0, exp - int(time.time()))
+    cache_control = f"public, max-age={max_age}, immutable"
+    return await _image_response(request, file_path, cache_control, w, h, image_format)
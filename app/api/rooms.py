@@ -0,0 +1,245 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.serialization import JSONBytesResponse
+from app.schemas.room import (
+    RoomCreate,
+    RoomMembersAdd,
+    RoomResponse,
+    RoomMemberResponse,
+    RoomMessageCreate,
+    RoomMessageResponse,
+    RoomMessagePage,
+)
+from app.services.room_service import RoomService, room_delivery_payload
+from app.services.receipt_writer import room_receipt_writer, LATEST, TooManyPendingReceipts
+from app.api.dependencies import (
+    get_current_user,
+    get_current_user_async,
+    get_rate_limited_sender_async,
+    limit_in_flight,
+    too_many_receipts,
+)
+from app.models.room import Room, RoomMember
+from app.models.user import User
+from app.websocket.connection_manager import manager
+
+router = APIRouter(prefix="/rooms", tags=["rooms"])
+
+
+def _room_response(room: Room, membership: RoomMember) -> RoomResponse:
+    return RoomResponse(
+        id=room.id,
+        name=room.name,
+        created_by=room.created_by,
+        created_at=room.created_at,
+        last_message_id=room.last_message_id,
+        unread_count=membership.unread,
+        read_up_to_id=membership.read_up_to_id
+    )
+
+
+def _room_not_found() -> HTTPException:
+    # Also for rooms the caller isn't in, so room ids can't be probed
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Room not found"
+    )
+
+
+def _require_membership(db: Session, room_id: int, user_id: int) -> RoomMember:
+    membership = RoomService.get_membership(db, room_id, user_id)
+    if membership is None:
+        raise _room_not_found()
+    return membership
+
+
+def _check_new_members(db: Session, user_ids: set, current_count: int):
+    missing = user_ids - RoomService.get_existing_user_ids(db, user_ids)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Users not found: {sorted(missing)}"
+        )
+    if current_count + len(user_ids) > settings.room_max_members:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Rooms are limited to {settings.room_max_members} members"
+        )
+
+
+@router.post("", response_model=RoomResponse, status_code=status.HTTP_201_CREATED)
+def create_room(
+    room: RoomCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    member_ids = set(room.member_ids) - {current_user.id}
+    _check_new_members(db, member_ids, 1)
+    
+    db_room = RoomService.create_room(db, room.name, current_user.id, member_ids)
+    return _room_response(db_room, RoomService.get_membership(db, db_room.id, current_user.id))
+
+
+@router.get("", response_model=List[RoomResponse])
+def get_my_rooms(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """The caller's rooms, most recently active first"""
+    return [
+        _room_response(room, membership)
+        for room, membership in RoomService.get_user_rooms(db, current_user.id)
+    ]
+
+
+@router.get("/{room_id}/members", response_model=List[RoomMemberResponse])
+def get_room_members(
+    room_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Members with their read and delivered marks ("seen by" for a message
+    is every member whose read_up_to_id is at least its id)"""
+    _require_membership(db, room_id, current_user.id)
+    return RoomService.get_members(db, room_id)
+
+
+@router.post("/{room_id}/members", status_code=status.HTTP_204_NO_CONTENT)
+def add_room_members(
+    room_id: int,
+    members: RoomMembersAdd,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Any member can add people; users who are already members are skipped"""
+    _require_membership(db, room_id, current_user.id)
+    user_ids = set(members.user_ids)
+    _check_new_members(db, user_ids, RoomService.count_members(db, room_id))
+    
+    RoomService.add_members(db, RoomService.get_room(db, room_id), user_ids)
+
+
+@router.delete("/{room_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+def remove_room_member(
+    room_id: int,
+    user_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Leave the room, or (as its creator) remove someone from it"""
+    _require_membership(db, room_id, current_user.id)
+    room = RoomService.get_room(db, room_id)
+    if user_id != current_user.id and room.created_by != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the room's creator can remove other members"
+        )
+    
+    if not RoomService.remove_member(db, room_id, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Member not found"
+        )
+
+
+@router.post(
+    "/{room_id}/messages",
+    response_model=RoomMessageResponse,
+    dependencies=[Depends(limit_in_flight("room-send", settings.send_max_in_flight))]
+)
+async def send_room_message(
+    room_id: int,
+    message: RoomMessageCreate,
+    current_user: User = Depends(get_rate_limited_sender_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Send to everyone in the room: one request and one message row, with
+    live delivery to the members who are online"""
+    # Membership check and fan-out list in one read
+    member_ids = await RoomService.get_member_ids_async(db, room_id)
+    if current_user.id not in member_ids:
+        raise _room_not_found()
+    
+    db_messages = await RoomService.create_room_messages_async(db, [(room_id, message, current_user.id)])
+    saved = db_messages[0]
+    
+    # Queued on each online member's sockets at once; their writers send concurrently
+    await manager.broadcast_to_users(
+        room_delivery_payload(saved, current_user.username),
+        [user_id for user_id in member_ids if user_id != current_user.id]
+    )
+    return saved
+
+
+@router.get("/{room_id}/messages", response_model=RoomMessagePage)
+def get_room_messages(
+    room_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    _require_membership(db, room_id, current_user.id)
+    
+    before_id = after_id = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+            before_id = position.get("before")
+            after_id = position.get("after")
+            if not all(v is None or isinstance(v, int) for v in (before_id, after_id)):
+                raise ValueError("Invalid cursor")
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    rows, has_more = RoomService.get_room_rows(
+        db, room_id, limit, before_id=before_id, after_id=after_id
+    )
+    
+    before_cursor = None
+    after_cursor = encode_cursor({"after": after_id}) if after_id is not None else None
+    if rows:
+        if has_more or after_id is not None:
+            before_cursor = encode_cursor({"before": rows[0].id})
+        after_cursor = encode_cursor({"after": rows[-1].id})
+    
+    return JSONBytesResponse({
+        "items": [row._asdict() for row in rows],
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor
+    })
+
+
+@router.post("/{room_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_room_read(
+    room_id: int,
+    up_to_id: Optional[int] = Query(None, ge=1),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Move the caller's read mark to `up_to_id` (default: the newest message).
+    Returns once the receipt is stored"""
+    try:
+        await room_receipt_writer.mark(current_user.id, room_id, read_id=up_to_id or LATEST, wait=True)
+    except TooManyPendingReceipts:
+        raise too_many_receipts()
+
+
+@router.post("/{room_id}/delivered", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_room_delivered(
+    room_id: int,
+    up_to_id: int = Query(..., ge=1),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Move the caller's delivered mark to `up_to_id`"""
+    try:
+        await room_receipt_writer.mark(current_user.id, room_id, delivered_id=up_to_id, wait=True)
+    except TooManyPendingReceipts:
+        raise too_many_receipts()
@@ -4,6 +4,29 @@ from typing import Optional
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./social_media.db"
+    # GET routes read through their own pool; point this at a replica to move
+    # those reads off the primary (defaults to database_url)
+    database_read_url: Optional[str] = None
+    
+    # Pool sizes for the write and read engines (sync and async each get one)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_read_pool_size: int = 10
+    db_read_max_overflow: int = 10
+    db_pool_timeout_seconds: float = 30.0
+    # Upgrade an out-of-date schema at startup; with several workers, disable
+    # this and run `alembic upgrade head` before starting them
+    db_auto_migrate: bool = True
+    
+    # SQLite tuning applied to every connection: WAL lets readers run alongside
+    # the writer, and synchronous=NORMAL is safe under WAL (a power cut may lose
+    # the last commits but can't corrupt the file). Read pool connections are
+    # query_only
+    sqlite_tuning: bool = True
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kib: int = 65536  # 64MB page cache per connection
+    sqlite_mmap_size: int = 268435456  # 256MB
+    
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
@@ -13,10 +36,90 @@ class Settings(BaseSettings):
     # supabase_key: Optional[str] = None
     # supabase_jwt_secret: Optional[str] = None
     
+    # Cache for decoded tokens and authenticated users
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: int = 60
+    
+    # Password hashing runs on its own pool, with a bounded backlog
+    bcrypt_rounds: int = 12  # Hashes with fewer rounds are upgraded on next login
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 32
+    password_hash_use_processes: bool = False
+    password_hash_retry_after_seconds: int = 1
+    
     # File upload settings
     max_file_size: int = 10485760  # 10MB
     upload_dir: str = "uploads"
     
+    # Public origin used in URLs returned to clients
+    public_base_url: str = "http://localhost:8000"
+    # Signed media URLs stay valid for one to two of these windows; URLs issued
+    # within the same window are identical so clients and proxies can cache them
+    media_url_ttl_seconds: int = 3600
+    
+    # Resized image derivatives. Keep the cache outside "uploads": that tree is
+    # served publicly, and thumbnails must only be reachable through signed URLs
+    thumbnail_cache_dir: str = "thumbnails"
+    thumbnail_cache_max_bytes: int = 536870912  # 512MB
+    thumbnail_workers: int = 2
+    # Larger sources aren't resized (413); decoding one takes ~3 bytes a pixel
+    thumbnail_max_source_pixels: int = 64000000
+    thumbnail_default_size: int = 256
+    
+    # WebSocket fan-out: "memory" (single worker) or "unix" (multi-worker, same host)
+    ws_backend: str = "memory"
+    ws_bus_dir: str = "/tmp/social-media-ws-bus"
+    # Per-socket outbound queue; when full: "drop_oldest", "coalesce" or "disconnect"
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: str = "drop_oldest"
+    ws_send_timeout_seconds: float = 10.0
+    # Heartbeats, for sockets connected with ?heartbeat=true: one silent this
+    # long gets {"type": "ping"}; one silent past the idle timeout (pongs
+    # included) is closed with 4408. 0 disables either; an interval of 0 turns
+    # heartbeats off entirely. Other sockets rely on uvicorn's protocol-level
+    # pings (--ws-ping-interval/--ws-ping-timeout)
+    ws_heartbeat_interval_seconds: float = 25.0
+    ws_idle_timeout_seconds: float = 75.0
+    # Presence subscriptions per socket, and how long changes are collected
+    # before one diff is pushed
+    ws_max_presence_subscriptions: int = 1000
+    presence_batch_window_ms: int = 1000
+    # Reconnect replay (?last_seen_id=): rows per query, and a cap before the
+    # client is told to page the rest over REST
+    ws_resume_batch_size: int = 200
+    ws_resume_max_messages: int = 5000
+    
+    # Group commit for WebSocket messages: flush after this many or this long
+    message_batch_size: int = 100
+    message_batch_window_ms: int = 5
+    # Beyond this many queued messages, WebSocket sends are shed ("Server busy")
+    message_writer_max_pending: int = 5000
+    # Read/delivery receipts are coalesced per conversation and flushed this
+    # often; a user may have receipts pending for this many conversations
+    receipt_batch_window_ms: int = 250
+    receipt_max_pending_per_reader: int = 100
+    
+    # Admission control. Per-user send budget (token bucket), shared by HTTP
+    # and WebSocket sends; 0 disables it. Over budget: 429 / WebSocket error frame
+    send_rate_per_second: float = 5.0
+    send_burst: int = 20
+    # Consecutive over-budget WebSocket frames before the socket is closed (4029)
+    ws_max_rate_limit_violations: int = 10
+    # Concurrent requests per route before fast 503s
+    send_max_in_flight: int = 64
+    upload_max_in_flight: int = 8
+    search_max_in_flight: int = 16
+    # Search pages through at most this many of the best-ranked hits
+    search_max_results: int = 200
+    
+    # Archival (python -m app.services.archive_service): messages older than
+    # this move to the archive table, in batches of this many per transaction
+    archive_after_days: int = 90
+    archive_batch_size: int = 1000
+    
+    # Group rooms: members per room (a send fans out to every online member)
+    room_max_members: int = 1000
+    
     class Config:
         env_file = ".env"
 
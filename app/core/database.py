@@ -1,23 +1,156 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
+from .metrics import instrument_engine
+import asyncio
 
 # For demo, using SQLite. Change to PostgreSQL in production
 SQLALCHEMY_DATABASE_URL = settings.database_url
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
-)
+# Async drivers for the same database, used by async routes and the WebSocket loop
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(database_url: str) -> str:
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+# GET routes use the read engines automatically (see get_db)
+SQLALCHEMY_READ_DATABASE_URL = settings.database_read_url or SQLALCHEMY_DATABASE_URL
+READ_METHODS = {"GET", "HEAD"}
+
+
+def _pool_args(database_url: str, pool_size: int, max_overflow: int) -> dict:
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite uses a per-thread singleton pool without these knobs
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+    }
+
+
+def _configure_sqlite(engine: Engine, read_only: bool):
+    """Apply the tuned SQLite pragmas to each new DBAPI connection"""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # Persistent in the database file; readers pick it up from there
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def _engine_options(database_url: str, read_only: bool) -> dict:
+    if read_only:
+        options = _pool_args(database_url, settings.db_read_pool_size, settings.db_read_max_overflow)
+    else:
+        options = _pool_args(database_url, settings.db_pool_size, settings.db_max_overflow)
+    if read_only and make_url(database_url).get_backend_name() == "postgresql":
+        options["execution_options"] = {"postgresql_readonly": True}
+    return options
+
+
+def _create_engines(database_url: str, read_only: bool):
+    """Sync and async engines for one database URL"""
+    options = _engine_options(database_url, read_only)
+    is_sqlite = make_url(database_url).get_backend_name() == "sqlite"
+    sync_engine = create_engine(
+        database_url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        **options
+    )
+    async_engine = create_async_engine(to_async_url(database_url), **options)
+    if is_sqlite and settings.sqlite_tuning:
+        _configure_sqlite(sync_engine, read_only)
+        _configure_sqlite(async_engine.sync_engine, read_only)
+    return sync_engine, async_engine
+
+
+engine, async_engine = _create_engines(SQLALCHEMY_DATABASE_URL, read_only=False)
+read_engine, async_read_engine = _create_engines(SQLALCHEMY_READ_DATABASE_URL, read_only=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
+# Statement timings, per-request query stats and pool checkout waits
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+instrument_engine(read_engine, "sync_read")
+instrument_engine(async_read_engine.sync_engine, "async_read")
 
-def get_db():
-    db = SessionLocal()
+# expire_on_commit=False: attribute access after commit would otherwise need implicit IO
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+AsyncReadSessionLocal = async_sessionmaker(
+    bind=async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+def _warm_size(engine: Engine) -> int:
+    # Connections the pool keeps open; 1 for pools without a fixed size
+    size = getattr(engine.pool, "size", None)
+    return size() if callable(size) else 1
+
+
+def warm_pool(engine: Engine) -> int:
+    """Open the pool's persistent connections now instead of on first requests"""
+    connections = [engine.connect() for _ in range(_warm_size(engine))]
+    for connection in connections:
+        connection.close()
+    return len(connections)
+
+
+async def warm_async_pool(engine: AsyncEngine) -> int:
+    connections = await asyncio.gather(*(
+        engine.connect().start() for _ in range(_warm_size(engine.sync_engine))
+    ))
+    await asyncio.gather(*(connection.close() for connection in connections))
+    return len(connections)
+
+
+def dialect_insert(dialect: str):
+    """INSERT construct with ON CONFLICT support for the given dialect name"""
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
+
+
+def get_db(request: Request):
+    """Session for the request; GET and HEAD get a read pool session"""
+    db = ReadSessionLocal() if request.method in READ_METHODS else SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db(request: Request):
+    session_factory = AsyncReadSessionLocal if request.method in READ_METHODS else AsyncSessionLocal
+    async with session_factory() as db:
+        yield db
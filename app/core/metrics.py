@@ -0,0 +1,236 @@
+"""Prometheus metrics: route latency, per-request DB work, pool waits, uploads.
+
+Each worker process keeps its own registry; scrape workers individually.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import time
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent in individual SQL statements",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed while handling one HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_query_seconds_per_request",
+    "Total SQL time spent while handling one HTTP request",
+    ["route"],
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+UPLOAD_BYTES = Counter(
+    "media_upload_bytes",
+    "Bytes received in media uploads; stored=false for deduplicated content",
+    ["stored"],
+)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "app_startup_phase_seconds",
+    "Time this worker spent in each startup phase",
+    ["phase"],
+)
+
+
+class _RequestDbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Set per HTTP request by MetricsMiddleware; sync routes run in the threadpool
+# with a copy of the context, so they update the same object
+_request_db_stats: ContextVar[Optional[_RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+def instrument_engine(engine: Engine, name: str):
+    """Time statements and pool checkouts on a (sync) engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.labels(name).observe(elapsed)
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # A failed statement never reaches after_cursor_execute. Errors raised
+        # while connecting or before the cursor ran left no start time
+        conn = context.connection
+        started = conn.info.get("query_started") if conn is not None else None
+        if started:
+            started.pop()
+
+    # dispose() swaps in a new pool, which needs timing again
+    @event.listens_for(engine, "engine_disposed")
+    def _disposed(engine):
+        _time_pool_checkout(engine.pool, name)
+
+    _time_pool_checkout(engine.pool, name)
+
+
+def _time_pool_checkout(pool, name: str):
+    # The pool has no "checkout started" event, so time its internal getter
+    do_get = pool._do_get
+
+    def _timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+    pool._do_get = _timed_do_get
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and DB work per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = _RequestDbStats()
+        token = _request_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_db_stats.reset(token)
+            # The router stores the matched route in the scope; raw paths would
+            # explode label cardinality
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route_label, str(status_code)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route_label).observe(stats.queries)
+            DB_SECONDS_PER_REQUEST.labels(route_label).observe(stats.seconds)
+
+
+class _CallbackCollector:
+    """Reads gauges/counters from live objects at scrape time"""
+
+    def __init__(self, collect: Callable[[], List]):
+        self._collect = collect
+
+    def collect(self):
+        return self._collect()
+
+    def describe(self):
+        return []
+
+
+def register_collector(collect: Callable[[], List]):
+    REGISTRY.register(_CallbackCollector(collect))
+
+
+def pool_metrics(engines) -> List:
+    checked_out = GaugeMetricFamily(
+        "db_pool_checked_out", "Connections currently checked out", labels=["engine"]
+    )
+    size = GaugeMetricFamily("db_pool_size", "Configured pool size", labels=["engine"])
+    for name, engine in engines.items():
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            checked_out.add_metric([name], pool.checkedout())
+            size.add_metric([name], pool.size())
+    return [checked_out, size]
+
+
+def websocket_metrics(stats: dict) -> List:
+    connections = GaugeMetricFamily("ws_connections", "Open WebSocket connections in this worker")
+    connections.add_metric([], stats["connections"])
+    users = GaugeMetricFamily("ws_users", "Users with an open WebSocket in this worker")
+    users.add_metric([], stats["users"])
+    queued = GaugeMetricFamily("ws_outbound_queued", "Frames waiting in outbound queues")
+    queued.add_metric([], stats["queued"])
+    outbound = CounterMetricFamily(
+        "ws_outbound_messages", "Outbound WebSocket messages by outcome", labels=["outcome"]
+    )
+    for outcome in ("enqueued", "sent", "dropped", "coalesced", "disconnected", "send_errors"):
+        outbound.add_metric([outcome], stats.get(outcome, 0))
+    frames = CounterMetricFamily("ws_outbound_frames", "WebSocket frames written")
+    frames.add_metric([], stats.get("frames", 0))
+    pings = CounterMetricFamily("ws_heartbeat_pings", "Heartbeat pings sent to silent sockets")
+    pings.add_metric([], stats.get("pings", 0))
+    reaped = CounterMetricFamily("ws_reaped_connections", "Sockets closed by the idle reaper")
+    reaped.add_metric([], stats.get("reaped", 0))
+    presence = GaugeMetricFamily("ws_presence_subscriptions", "Presence subscriptions held by open sockets")
+    presence.add_metric([], stats["presence_subscriptions"])
+    return [connections, users, queued, outbound, frames, pings, reaped, presence]
+
+
+class StartupTimer:
+    """Times named startup phases for the log, /health and /metrics"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.total: Optional[float] = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = elapsed
+            STARTUP_PHASE_SECONDS.labels(name).set(elapsed)
+            print(f"Startup phase {name}: {elapsed * 1000:.1f}ms")
+
+    async def timed(self, name: str, awaitable):
+        """Time an awaitable as a phase, so independent phases can run concurrently"""
+        with self.phase(name):
+            return await awaitable
+
+    def finish(self):
+        self.total = time.perf_counter() - self._started
+        STARTUP_PHASE_SECONDS.labels("total").set(self.total)
+        print(f"Startup complete in {self.total * 1000:.1f}ms")
+
+    def report(self) -> dict:
+        return {
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "total_ms": round(self.total * 1000, 1) if self.total is not None else None,
+        }
@@ -0,0 +1,42 @@
+"""Schema versioning through Alembic (revisions live in migrations/).
+
+Startup compares the database's revision with the newest one in the code
+instead of reflecting the schema with create_all. With DB_AUTO_MIGRATE
+(the default) a database that is behind is upgraded in place; otherwise
+startup fails and `alembic upgrade head` has to run first, which is what
+multi-worker deployments should do as a separate release step.
+"""
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.engine import Engine
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def alembic_config() -> Config:
+    return Config(os.path.join(ROOT, "alembic.ini"))
+
+
+def ensure_schema(engine: Engine, auto_upgrade: bool) -> str:
+    """Bring the database to the head revision; returns what was done"""
+    config = alembic_config()
+    head = ScriptDirectory.from_config(config).get_current_head()
+    with engine.begin() as connection:
+        current = MigrationContext.configure(connection).get_current_revision()
+        if current == head:
+            return f"at {head}"
+        if not auto_upgrade:
+            raise SchemaOutOfDate(
+                f"Database schema is at {current or 'no revision'} but the code expects {head}; "
+                "run `alembic upgrade head`"
+            )
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+    return f"upgraded {current or 'unversioned'} -> {head}"
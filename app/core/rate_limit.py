@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+import math
+import threading
+import time
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `rate` tokens per second refill up to `burst`.
+
+    Thread-safe for the same reason as TTLCache. Buckets are kept LRU up to
+    `maxsize` keys; an evicted key simply starts over with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.admitted = 0
+        self.rejected = 0
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, cost: int = 1) -> float:
+        """Take `cost` tokens; returns 0 if admitted, otherwise the seconds until
+        they would be available (inf if `cost` exceeds the burst)"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+                self.admitted += 1
+            else:
+                wait = math.inf if cost > self.burst else (cost - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class InFlightLimiter:
+    """Caps concurrent requests; callers that don't get a slot are shed at once"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+def retry_after(wait: float) -> int:
+    """Whole seconds for a Retry-After header"""
+    return max(1, math.ceil(wait)) if math.isfinite(wait) else 60
+
+
+# Registered by route name for /health
+in_flight_limiters: Dict[str, InFlightLimiter] = {}
@@ -1,11 +1,27 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import hmac
 import jwt
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
+from .cache import TTLCache
 from .config import settings
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below bcrypt_rounds count as deprecated, so verify_and_update re-hashes them
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds
+)
+
+# Decoded tokens: {token: user_id}, never kept past the token's own expiry
+token_cache = TTLCache(settings.principal_cache_size, settings.principal_cache_ttl_seconds)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -16,6 +32,120 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; also returns a new hash if the stored one uses an outdated cost"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _warm_up_hash() -> str:
+    return pwd_context.handler("bcrypt").using(rounds=4).hash("warm-up")
+
+
+class PasswordHasherOverloaded(Exception):
+    pass
+
+
+def _timed(func, *args):
+    # Runs in the pool; wall-clock start time is comparable across processes
+    started_at = time.time()
+    result = func(*args)
+    return result, started_at, time.time() - started_at
+
+
+class PasswordHasher:
+    """Dedicated pool for bcrypt so login storms can't exhaust the shared threadpool.
+
+    At most `workers + max_queue` hashes are admitted at once; beyond that
+    callers get PasswordHasherOverloaded immediately instead of queueing.
+    """
+
+    def __init__(self, workers: int, max_queue: int, use_processes: bool = False):
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self.use_processes = use_processes
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
+
+    async def _run(self, func, *args):
+        # Only touched from the event loop, so the counters need no lock
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherOverloaded()
+
+        self.pending += 1
+        submitted_at = time.time()
+        try:
+            result, started_at, duration = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _timed, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+        queue_wait = max(0.0, started_at - submitted_at)
+        self.completed += 1
+        self.queue_wait_seconds_total += queue_wait
+        self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, queue_wait)
+        self.hash_seconds_total += duration
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update_password, plain_password, hashed_password)
+
+    async def warm_up(self):
+        """Start every worker and load the bcrypt backend in it, so the first
+        logins don't pay for either"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        # A 4-round hash keeps this cheap; verify loads the same backend as any cost
+        warm_hash = await loop.run_in_executor(executor, _warm_up_hash)
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, verify_password, "warm-up", warm_hash)
+            for _ in range(self.workers)
+        ))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds_avg": round(self.queue_wait_seconds_total / completed, 6),
+            "queue_wait_seconds_max": round(self.queue_wait_seconds_max, 6),
+            "hash_seconds_avg": round(self.hash_seconds_total / completed, 6),
+        }
+
+
+password_hasher = PasswordHasher(
+    settings.password_hash_workers,
+    settings.password_hash_max_queue,
+    settings.password_hash_use_processes
+)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -28,14 +158,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 def verify_token(token: str):
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         user_id: str = payload.get("sub")
         if user_id is None:
             return None
-        return user_id
     except InvalidTokenError:
         return None
+    
+    if "exp" in payload:
+        token_cache.set(token, user_id, ttl=payload["exp"] - time.time())
+    return user_id
+
+
+def warm_up_tokens():
+    """Encode and decode one throwaway token so PyJWT's first-use setup happens
+    at startup; it bypasses token_cache"""
+    token = create_access_token({"sub": "warm-up"}, timedelta(seconds=60))
+    jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+
+
+def sign_media_path(path: str, expires_at: int) -> str:
+    """HMAC signature authorizing `path` until `expires_at` (unix seconds)"""
+    digest = hmac.new(
+        settings.secret_key.encode(), f"media:{path}:{expires_at}".encode(), hashlib.sha256
+    ).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+
+def verify_media_signature(path: str, expires_at: int, signature: str) -> bool:
+    if expires_at < time.time():
+        return False
+    return hmac.compare_digest(sign_media_path(path, expires_at), signature)
 
 
 # Supabase JWT verification (commented for demo)
@@ -0,0 +1,24 @@
+from typing import Any
+from fastapi.responses import Response
+import orjson
+
+
+def dumps(content: Any) -> bytes:
+    """JSON bytes in the same shape pydantic would emit for our schemas.
+
+    Enums encode as their value; OPT_UTC_Z writes UTC datetimes with the "Z"
+    suffix pydantic uses.
+    """
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+class JSONBytesResponse(Response):
+    """JSON response for routes that build plain dicts/rows themselves and skip
+    response_model validation; pre-encoded bytes pass straight through"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.core.database import Base
+from app.models.message import MessageType
+
+
+class Conversation(Base):
+    """Denormalized inbox row, one per participant pair (user_low_id < user_high_id)"""
+    __tablename__ = "conversations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_low_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_high_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    last_sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_message_type = Column(Enum(MessageType), default=MessageType.TEXT)
+    last_message_preview = Column(String, nullable=True)
+    last_message_at = Column(DateTime(timezone=True), server_default=func.now())
+    unread_low = Column(Integer, nullable=False, default=0)  # Unread by user_low_id
+    unread_high = Column(Integer, nullable=False, default=0)  # Unread by user_high_id
+    # Receipts: per-participant high-water marks (message ids), never per-message flags
+    read_low_id = Column(Integer, nullable=False, default=0, server_default="0")
+    read_high_id = Column(Integer, nullable=False, default=0, server_default="0")
+    delivered_low_id = Column(Integer, nullable=False, default=0, server_default="0")
+    delivered_high_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        UniqueConstraint("user_low_id", "user_high_id", name="uq_conversations_pair"),
+        # Message ids grow monotonically, so last_message_id doubles as a recency key
+        Index("ix_conversations_low_recent", "user_low_id", "last_message_id"),
+        Index("ix_conversations_high_recent", "user_high_id", "last_message_id"),
+    )
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Index
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import GenericFunction
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
 import enum
 from app.core.database import Base
@@ -13,6 +15,27 @@ class MessageType(enum.Enum):
     FILE = "file"
 
 
+class least(GenericFunction):
+    type = Integer()
+    inherit_cache = True
+
+
+class greatest(GenericFunction):
+    type = Integer()
+    inherit_cache = True
+
+
+# SQLite has no LEAST/GREATEST, but its multi-argument min/max are scalar
+@compiles(least, "sqlite")
+def _sqlite_least(element, compiler, **kw):
+    return "min(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(greatest, "sqlite")
+def _sqlite_greatest(element, compiler, **kw):
+    return "max(%s)" % compiler.process(element.clauses, **kw)
+
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -26,4 +49,48 @@ class Message(Base):
     
     # Relationships
     sender = relationship("User", foreign_keys=[sender_id])
-    receiver = relationship("User", foreign_keys=[receiver_id])
\ No newline at end of file
+    receiver = relationship("User", foreign_keys=[receiver_id])
+    
+    # Fetch server-generated created_at in the INSERT (RETURNING) instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
+
+
+def conversation_pair(model):
+    """Normalized participant pair: both directions of a chat map to the same
+    (low, high) key so they share one contiguous index range"""
+    return least(model.sender_id, model.receiver_id), greatest(model.sender_id, model.receiver_id)
+
+Index(
+    "ix_messages_conversation",
+    least(Message.sender_id, Message.receiver_id),
+    greatest(Message.sender_id, Message.receiver_id),
+    Message.created_at,
+    Message.id,
+)
+
+# Inbox range scan for reconnect replay: everything a user received after an id
+Index("ix_messages_receiver_id_id", Message.receiver_id, Message.id)
+
+
+class ArchivedMessage(Base):
+    """Cold tier: messages moved out of `messages` by the archival job, under
+    their original ids. Only the indexes that history reads need are kept."""
+    __tablename__ = "messages_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content = Column(Text, nullable=True)
+    message_type = Column(Enum(MessageType), default=MessageType.TEXT)
+    file_url = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True))
+
+
+Index(
+    "ix_messages_archive_conversation",
+    least(ArchivedMessage.sender_id, ArchivedMessage.receiver_id),
+    greatest(ArchivedMessage.sender_id, ArchivedMessage.receiver_id),
+    ArchivedMessage.created_at,
+    ArchivedMessage.id,
+)
+Index("ix_messages_archive_receiver_id_id", ArchivedMessage.receiver_id, ArchivedMessage.id)
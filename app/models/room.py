@@ -0,0 +1,54 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Index
+from sqlalchemy.sql import func
+from app.core.database import Base
+from app.models.message import MessageType
+
+
+class Room(Base):
+    """Group conversation; who is in it lives in room_members"""
+    __tablename__ = "rooms"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Newest room_messages.id (0 until the first send); no FK, the tables reference each other
+    last_message_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class RoomMember(Base):
+    """Membership plus the member's delivery state, kept as high-water marks
+    (room message ids) and an unread counter rather than per-message rows"""
+    __tablename__ = "room_members"
+
+    room_id = Column(Integer, ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    joined_at = Column(DateTime(timezone=True), server_default=func.now())
+    unread = Column(Integer, nullable=False, default=0, server_default="0")
+    read_up_to_id = Column(Integer, nullable=False, default=0, server_default="0")
+    delivered_up_to_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # The primary key serves fan-out (members of a room); this serves "my rooms"
+        Index("ix_room_members_user_id", "user_id", "room_id"),
+    )
+
+
+class RoomMessage(Base):
+    """A group message, stored once however many members the room has"""
+    __tablename__ = "room_messages"
+
+    id = Column(Integer, primary_key=True)
+    room_id = Column(Integer, ForeignKey("rooms.id", ondelete="CASCADE"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content = Column(Text, nullable=True)
+    message_type = Column(Enum(MessageType), default=MessageType.TEXT)
+    file_url = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # History pages and unread recounts are range scans within one room
+        Index("ix_room_messages_room_id_id", "room_id", "id"),
+    )
+
+    __mapper_args__ = {"eager_defaults": True}
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+from app.models.message import MessageType
+
+
+class ConversationResponse(BaseModel):
+    id: int
+    other_user_id: int
+    last_message_id: int
+    last_sender_id: int
+    last_message_type: MessageType
+    last_message_preview: Optional[str] = None
+    last_message_at: datetime
+    unread_count: int
+    # Receipt high-water marks (message ids; 0 when nothing was marked yet)
+    read_up_to_id: int = 0
+    other_read_up_to_id: int = 0
+    other_delivered_up_to_id: int = 0
+
+
+class InboxPage(BaseModel):
+    items: List[ConversationResponse]
+    next_cursor: Optional[str] = None  # Older conversations, None when exhausted
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from app.models.message import MessageType
 
@@ -19,12 +19,29 @@ class MessageResponse(MessageBase):
     sender_id: int
     file_url: Optional[str] = None
     image_url: Optional[str] = None  # Full URL for accessing image
+    thumbnail_url: Optional[str] = None  # Downscaled WebP preview of image_url
     created_at: datetime
     
     class Config:
         from_attributes = True
 
 
+class MessagePage(BaseModel):
+    items: List[MessageResponse]
+    before_cursor: Optional[str] = None  # Older page, None when history is exhausted
+    after_cursor: Optional[str] = None  # Newer messages, reusable for polling
+
+
+class SearchHit(MessageResponse):
+    score: float  # Lower ranks first
+    highlight: Optional[str] = None  # Matching excerpt, terms wrapped in <mark></mark>
+
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None  # Next page of lower-ranked hits
+
+
 class ChatMessage(BaseModel):
     message: str
     receiver_id: int
@@ -0,0 +1,57 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+from app.models.message import MessageType
+
+
+class RoomCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    member_ids: List[int] = []  # The creator is always a member
+
+
+class RoomMembersAdd(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1)
+
+
+class RoomResponse(BaseModel):
+    id: int
+    name: str
+    created_by: int
+    created_at: datetime
+    last_message_id: int
+    # The caller's state in the room
+    unread_count: int = 0
+    read_up_to_id: int = 0
+
+
+class RoomMemberResponse(BaseModel):
+    user_id: int
+    joined_at: datetime
+    # Receipt high-water marks (room message ids; 0 when nothing was marked yet)
+    read_up_to_id: int
+    delivered_up_to_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class RoomMessageCreate(BaseModel):
+    content: Optional[str] = None
+    message_type: MessageType = MessageType.TEXT
+
+
+class RoomMessageResponse(RoomMessageCreate):
+    id: int
+    room_id: int
+    sender_id: int
+    file_url: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class RoomMessagePage(BaseModel):
+    items: List[RoomMessageResponse]
+    before_cursor: Optional[str] = None  # Older page, None when history is exhausted
+    after_cursor: Optional[str] = None  # Newer messages, reusable for polling
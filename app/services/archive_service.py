@@ -0,0 +1,49 @@
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.conversation import Conversation
+from app.models.message import ArchivedMessage, Message
+from app.services.message_service import message_columns
+from datetime import datetime, timedelta, timezone
+
+
+class ArchiveService:
+    @staticmethod
+    def archive_messages(db: Session, older_than: datetime, batch_size: int = 1000) -> int:
+        """Move messages created before `older_than` to the archive tier; returns
+        how many moved.
+
+        Each batch is copied and deleted in one transaction, so a message is in
+        exactly one tier at any time and keeps its id. A conversation's latest
+        message stays hot because its inbox row references it. Media references
+        move with the message, so blob ref counts don't change.
+        """
+        columns = message_columns(Message)
+        latest = select(Conversation.last_message_id)
+        moved = 0
+        while True:
+            ids = list(db.scalars(
+                select(Message.id)
+                .where(Message.created_at < older_than, Message.id.not_in(latest))
+                .order_by(Message.id)
+                .limit(batch_size)
+            ))
+            if not ids:
+                return moved
+
+            db.execute(insert(ArchivedMessage).from_select(
+                [column.key for column in columns],
+                select(*columns).where(Message.id.in_(ids))
+            ))
+            db.execute(delete(Message).where(Message.id.in_(ids)))
+            db.commit()
+            moved += len(ids)
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+    with SessionLocal() as db:
+        moved = ArchiveService.archive_messages(db, cutoff, settings.archive_batch_size)
+    print(f"Archived {moved} messages older than {cutoff:%Y-%m-%d %H:%M}")
@@ -1,10 +1,26 @@
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.user import User
 from app.schemas.user import UserCreate
-from app.core.security import get_password_hash, verify_password, create_access_token
+from app.core.cache import TTLCache
+from app.core.security import get_password_hash, verify_password, create_access_token, password_hasher
 from datetime import timedelta
 from app.core.config import settings
 
+# Authenticated principals: {user_id: detached User snapshot}
+user_cache = TTLCache(settings.principal_cache_size, settings.principal_cache_ttl_seconds)
+
+
+def _snapshot(user: User) -> User:
+    # A transient copy never expires or lazy-loads, so it is safe to share
+    # across sessions; the password hash is left out on purpose
+    return User(**{
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns
+        if column.key != "hashed_password"
+    })
+
 
 class AuthService:
     @staticmethod
@@ -21,6 +37,20 @@ class AuthService:
         db.refresh(db_user)
         return db_user
     
+    @staticmethod
+    async def create_user_async(db: AsyncSession, user: UserCreate) -> User:
+        hashed_password = await password_hasher.hash(user.password)
+        db_user = User(
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name,
+            hashed_password=hashed_password
+        )
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
+    
     @staticmethod
     def get_user_by_username(db: Session, username: str) -> User:
         return db.query(User).filter(User.username == username).first()
@@ -33,6 +63,45 @@ class AuthService:
     def get_user_by_id(db: Session, user_id: int) -> User:
         return db.query(User).filter(User.id == user_id).first()
     
+    @staticmethod
+    def get_user_by_id_cached(db: Session, user_id: int) -> User:
+        """Read-only user snapshot for authorization checks, served from user_cache"""
+        user = user_cache.get(user_id)
+        if user is None:
+            user = AuthService.get_user_by_id(db, user_id)
+            if user is None:
+                return None
+            user = _snapshot(user)
+            user_cache.set(user_id, user)
+        return user
+    
+    @staticmethod
+    def invalidate_user(user_id: int):
+        user_cache.invalidate(user_id)
+    
+    @staticmethod
+    async def get_user_by_username_async(db: AsyncSession, username: str) -> User:
+        return await db.scalar(select(User).where(User.username == username))
+    
+    @staticmethod
+    async def get_user_by_email_async(db: AsyncSession, email: str) -> User:
+        return await db.scalar(select(User).where(User.email == email))
+    
+    @staticmethod
+    async def get_user_by_id_async(db: AsyncSession, user_id: int) -> User:
+        return await db.get(User, user_id)
+    
+    @staticmethod
+    async def get_user_by_id_cached_async(db: AsyncSession, user_id: int) -> User:
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await AuthService.get_user_by_id_async(db, user_id)
+            if user is None:
+                return None
+            user = _snapshot(user)
+            user_cache.set(user_id, user)
+        return user
+    
     @staticmethod
     def authenticate_user(db: Session, username: str, password: str) -> User:
         user = AuthService.get_user_by_username(db, username)
@@ -40,10 +109,34 @@ class AuthService:
             return None
         return user
     
+    @staticmethod
+    async def authenticate_user_async(db: AsyncSession, username: str, password: str) -> User:
+        user = await AuthService.get_user_by_username_async(db, username)
+        if not user:
+            return None
+        
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not valid:
+            return None
+        
+        if new_hash:
+            # Stored hash predates the current bcrypt_rounds; upgrade it transparently
+            user.hashed_password = new_hash
+            await db.commit()
+        return user
+    
     @staticmethod
     def create_access_token_for_user(user: User) -> str:
         access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
         access_token = create_access_token(
             data={"sub": str(user.id)}, expires_delta=access_token_expires
         )
-        return access_token
\ No newline at end of file
+        return access_token
+
+
+# ORM-level changes (profile edits, deactivation, deletion) drop the cached principal.
+# Bulk query.update()/delete() bypass these hooks and must call invalidate_user.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    AuthService.invalidate_user(target.id)
@@ -0,0 +1,178 @@
+from sqlalchemy import Integer, bindparam, case, func, select, tuple_, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.database import dialect_insert
+from app.models.conversation import Conversation
+from app.models.message import ArchivedMessage, Message, MessageType, least, greatest
+from typing import List, Optional, Tuple
+
+PREVIEW_LENGTH = 100
+
+
+class ConversationService:
+    @staticmethod
+    def _preview(message: Message) -> Optional[str]:
+        if message.content:
+            return message.content[:PREVIEW_LENGTH]
+        if message.message_type != MessageType.TEXT:
+            return f"[{message.message_type.value}]"
+        return None
+
+    @staticmethod
+    def _upsert_statement(dialect: str, message: Message):
+        low_id = min(message.sender_id, message.receiver_id)
+        high_id = max(message.sender_id, message.receiver_id)
+        unread_low = int(message.receiver_id == low_id and message.sender_id != low_id)
+        unread_high = int(message.receiver_id == high_id and message.sender_id != high_id)
+
+        last_message = {
+            "last_message_id": message.id,
+            "last_sender_id": message.sender_id,
+            "last_message_type": message.message_type,
+            "last_message_preview": ConversationService._preview(message),
+            "last_message_at": func.now(),
+        }
+        table = Conversation.__table__
+        stmt = dialect_insert(dialect)(Conversation).values(
+            user_low_id=low_id,
+            user_high_id=high_id,
+            unread_low=unread_low,
+            unread_high=unread_high,
+            **last_message
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.user_low_id, table.c.user_high_id],
+            set_={
+                **last_message,
+                "unread_low": table.c.unread_low + unread_low,
+                "unread_high": table.c.unread_high + unread_high,
+            }
+        )
+
+    @staticmethod
+    def record_message(db: Session, message: Message) -> None:
+        """Upsert the inbox row for a flushed message; the caller owns the commit"""
+        db.execute(ConversationService._upsert_statement(db.get_bind().dialect.name, message))
+
+    @staticmethod
+    async def record_message_async(db: AsyncSession, message: Message) -> None:
+        await db.execute(ConversationService._upsert_statement(db.get_bind().dialect.name, message))
+
+    @staticmethod
+    def get_inbox_page(
+        db: Session,
+        user_id: int,
+        limit: int,
+        before_message_id: Optional[int] = None
+    ) -> Tuple[List[Conversation], bool]:
+        """Return the user's conversations, most recent first, and whether more exist"""
+        sides = []
+        for column in (Conversation.user_low_id, Conversation.user_high_id):
+            side = select(Conversation.id, Conversation.last_message_id).where(column == user_id)
+            if before_message_id is not None:
+                side = side.where(Conversation.last_message_id < before_message_id)
+            # Each side is a bounded range scan on its (user, last_message_id) index
+            sides.append(
+                select(side.order_by(Conversation.last_message_id.desc()).limit(limit + 1).subquery())
+            )
+        candidates = union_all(*sides).subquery()
+
+        conversations = db.query(Conversation).filter(
+            Conversation.id.in_(select(candidates.c.id))
+        ).order_by(Conversation.last_message_id.desc()).limit(limit + 1).all()
+
+        has_more = len(conversations) > limit
+        return conversations[:limit], has_more
+
+    @staticmethod
+    async def get_contact_ids_async(db: AsyncSession, user_id: int, candidate_ids: List[int]) -> List[int]:
+        """The candidates the user shares a conversation with"""
+        stmt = union_all(
+            select(Conversation.user_high_id).where(
+                Conversation.user_low_id == user_id, Conversation.user_high_id.in_(candidate_ids)
+            ),
+            select(Conversation.user_low_id).where(
+                Conversation.user_high_id == user_id, Conversation.user_low_id.in_(candidate_ids)
+            )
+        )
+        return list(await db.scalars(stmt))
+
+    @staticmethod
+    def _receipt_statement(reader_is_low: bool):
+        """UPDATE for one side's marks, executed with many parameter sets
+        (reader_id, peer_id, read_id, delivered_id)"""
+        c = Conversation.__table__.c
+        if reader_is_low:
+            reader, peer, read, delivered, unread = (
+                c.user_low_id, c.user_high_id, c.read_low_id, c.delivered_low_id, c.unread_low
+            )
+        else:
+            reader, peer, read, delivered, unread = (
+                c.user_high_id, c.user_low_id, c.read_high_id, c.delivered_high_id, c.unread_high
+            )
+
+        # Marks only move forward and never past the conversation's newest message
+        read_id = least(greatest(read, bindparam("read_id", type_=Integer)), c.last_message_id)
+        # A read mark can land in archived history, so both tiers are counted;
+        # each count is a range scan on that tier's (receiver_id, id) index
+        hot_unread, archived_unread = (
+            select(func.count()).select_from(model).where(
+                model.receiver_id == reader,
+                model.sender_id == peer,
+                model.sender_id != model.receiver_id,
+                model.id > read_id
+            ).scalar_subquery()
+            for model in (Message, ArchivedMessage)
+        )
+        still_unread = hot_unread + archived_unread
+        return update(Conversation.__table__).where(
+            reader == bindparam("reader_id"),
+            peer == bindparam("peer_id")
+        ).values({
+            read: read_id,
+            # Reading implies delivery
+            delivered: greatest(delivered, least(bindparam("delivered_id", type_=Integer), c.last_message_id), read_id),
+            # Counted only when the read mark moves and stops short of the newest message
+            unread: case(
+                (read_id >= c.last_message_id, 0),
+                (read_id > read, still_unread),
+                else_=unread
+            ),
+        })
+
+    @staticmethod
+    async def apply_receipts_async(
+        db: AsyncSession, receipts: List[Tuple[int, int, int, int]]
+    ) -> List[Tuple[int, int, int, int]]:
+        """Advance (reader_id, peer_id, read_id, delivered_id) marks in one
+        transaction, one row update per conversation side. Returns the stored
+        marks in the same shape for conversations that exist."""
+        sides = {True: [], False: []}
+        for reader_id, peer_id, read_id, delivered_id in receipts:
+            # Notes to self (reader == peer) live on the low side
+            sides[reader_id <= peer_id].append({
+                "reader_id": reader_id, "peer_id": peer_id, "read_id": read_id, "delivered_id": delivered_id
+            })
+        for reader_is_low, params in sides.items():
+            if params:
+                await db.execute(ConversationService._receipt_statement(reader_is_low), params)
+
+        pairs = {(min(r[0], r[1]), max(r[0], r[1])) for r in receipts}
+        rows = {
+            (row.user_low_id, row.user_high_id): row
+            for row in await db.execute(select(Conversation.__table__).where(
+                tuple_(Conversation.user_low_id, Conversation.user_high_id).in_(pairs)
+            ))
+        }
+        await db.commit()
+
+        stored = []
+        for reader_id, peer_id, _, _ in receipts:
+            row = rows.get((min(reader_id, peer_id), max(reader_id, peer_id)))
+            if row is None:
+                continue
+            if reader_id == row.user_low_id:
+                stored.append((reader_id, peer_id, row.read_low_id, row.delivered_low_id))
+            else:
+                stored.append((reader_id, peer_id, row.read_high_id, row.delivered_high_id))
+        return stored
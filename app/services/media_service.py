@@ -0,0 +1,138 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import dialect_insert
+from app.core.security import sign_media_path
+from app.models.media import MediaBlob
+from typing import NamedTuple, Optional
+from urllib.parse import quote, urlencode
+import os
+import time
+
+
+class StoredFile(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    content_type: Optional[str] = None
+
+
+def blob_path(upload_dir: str, sha256: str, extension: str = "") -> str:
+    # Two-character shard directories keep any single directory small
+    return os.path.join(upload_dir, sha256[:2], sha256 + extension)
+
+
+def signed_media_url(file_path: str, **params) -> Optional[str]:
+    """Short-lived URL for a stored file that can be served without auth or DB access"""
+    relative_path = os.path.relpath(file_path, settings.upload_dir).replace(os.sep, "/")
+    if relative_path.startswith("../"):
+        return None
+
+    # Bucketed expiry keeps the URL stable within a TTL window, so it stays cacheable
+    ttl = settings.media_url_ttl_seconds
+    expires_at = (int(time.time()) // ttl + 2) * ttl
+    query = {**params, "exp": expires_at, "sig": sign_media_path(relative_path, expires_at)}
+    return f"{settings.public_base_url}/messages/media/{quote(relative_path)}?{urlencode(query)}"
+
+
+def resolve_media_path(relative_path: str) -> Optional[str]:
+    """Map a signed relative path back to a file inside the upload dir"""
+    upload_dir = os.path.realpath(settings.upload_dir)
+    path = os.path.realpath(os.path.join(upload_dir, relative_path))
+    if os.path.commonpath([upload_dir, path]) != upload_dir:
+        return None
+    return path
+
+
+class MediaService:
+    @staticmethod
+    def _acquire_statement(dialect: str, stored: StoredFile):
+        table = MediaBlob.__table__
+        stmt = dialect_insert(dialect)(MediaBlob).values(
+            sha256=stored.sha256,
+            path=stored.path,
+            size=stored.size,
+            content_type=stored.content_type,
+            ref_count=1
+        )
+        # The first upload's path (and content type) stays on the row; a later
+        # upload of the same bytes under another extension references it too
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.sha256],
+            set_={"ref_count": table.c.ref_count + 1}
+        ).returning(table.c.path)
+
+    @staticmethod
+    def acquire(db: Session, stored: StoredFile) -> str:
+        """Count one more message referencing the blob and return the path the
+        message must use; the caller owns the commit"""
+        return db.execute(MediaService._acquire_statement(db.get_bind().dialect.name, stored)).scalar_one()
+
+    @staticmethod
+    async def acquire_async(db: AsyncSession, stored: StoredFile) -> str:
+        result = await db.execute(MediaService._acquire_statement(db.get_bind().dialect.name, stored))
+        return result.scalar_one()
+
+    @staticmethod
+    async def get_blob_path_async(db: AsyncSession, sha256: str) -> Optional[str]:
+        return await db.scalar(select(MediaBlob.path).where(MediaBlob.sha256 == sha256))
+
+    @staticmethod
+    def release(db: Session, path: str) -> None:
+        """Drop one reference, e.g. when a message is deleted; the caller owns the commit"""
+        db.execute(
+            update(MediaBlob).where(MediaBlob.path == path).values(ref_count=MediaBlob.ref_count - 1)
+        )
+
+    @staticmethod
+    def collect_garbage(db: Session, upload_dir: str, grace_seconds: int = 3600) -> int:
+        """Delete unreferenced blobs and orphaned shard files; returns files removed.
+
+        Files touched within `grace_seconds` are kept: a deduplicated upload touches
+        the existing blob before taking its reference, and a fresh upload is written
+        before its row is committed.
+        """
+        cutoff = time.time() - grace_seconds
+        removed = 0
+
+        def is_stale(path: str) -> bool:
+            try:
+                return os.path.getmtime(path) < cutoff
+            except FileNotFoundError:
+                return True
+
+        for blob in db.scalars(select(MediaBlob).where(MediaBlob.ref_count <= 0)).all():
+            if not is_stale(blob.path):
+                continue
+            # Re-check the count in the DELETE so a concurrent acquire wins
+            result = db.execute(
+                delete(MediaBlob).where(MediaBlob.id == blob.id, MediaBlob.ref_count <= 0)
+            )
+            db.commit()
+            if result.rowcount:
+                try:
+                    os.remove(blob.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+
+        known_paths = set(db.scalars(select(MediaBlob.path)))
+        for shard in os.listdir(upload_dir) if os.path.isdir(upload_dir) else []:
+            shard_dir = os.path.join(upload_dir, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, name)
+                if path not in known_paths and is_stale(path):
+                    os.remove(path)
+                    removed += 1
+
+        return removed
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    with SessionLocal() as db:
+        print(f"Removed {MediaService.collect_garbage(db, settings.upload_dir)} media files")
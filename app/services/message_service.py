@@ -1,68 +1,404 @@
+from sqlalchemy import Row, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models.message import Message, MessageType
+from app.core.metrics import UPLOAD_BYTES
+from app.models.message import ArchivedMessage, Message, MessageType, conversation_pair
+from app.models.user import User
 from app.schemas.message import MessageCreate
-from typing import List, Optional
+from app.services.conversation_service import ConversationService
+from app.services.media_service import MediaService, StoredFile, blob_path
+from typing import List, Optional, Tuple
+import hashlib
+import mimetypes
 import os
+import re
+import uuid
 import aiofiles
+import aiofiles.os
 from fastapi import UploadFile
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+_utime = aiofiles.os.wrap(os.utime)
+_SAFE_EXTENSION = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+# Hot tier first; ArchivedMessage holds what the archival job moved out
+TIERS = (Message, ArchivedMessage)
+
+
+def message_columns(model) -> tuple:
+    """Columns behind MessageResponse, for list endpoints that serialize rows directly"""
+    return (
+        model.id,
+        model.sender_id,
+        model.receiver_id,
+        model.content,
+        model.message_type,
+        model.file_url,
+        model.created_at,
+    )
+
+
+MESSAGE_COLUMNS = message_columns(Message)
+
+
+class FileTooLargeError(Exception):
+    pass
+
 
 class MessageService:
+    # Statement builders are shared by the sync and async variants below. Reads
+    # take the tier model (Message or ArchivedMessage), which have the same columns
+
     @staticmethod
-    def create_message(db: Session, message: MessageCreate, sender_id: int) -> Message:
-        db_message = Message(
+    def _conversation_stmt(user1_id: int, user2_id: int, model=Message):
+        low, high = conversation_pair(model)
+        return select(model).where(low == min(user1_id, user2_id), high == max(user1_id, user2_id))
+
+    @staticmethod
+    def _conversation_page_stmt(
+        user1_id: int,
+        user2_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        model=Message
+    ):
+        stmt = MessageService._conversation_stmt(user1_id, user2_id, model)
+        position = tuple_(model.created_at, model.id)
+        anchor_id = after_id if after_id is not None else before_id
+
+        if anchor_id is not None:
+            # Resolve the anchor's timestamp in SQL so the comparison uses the stored
+            # value; COALESCE only looks in the archive when the anchor isn't hot
+            anchor_created_at = func.coalesce(*(
+                select(tier.created_at).where(tier.id == anchor_id).scalar_subquery()
+                for tier in TIERS
+            ))
+            anchor = tuple_(anchor_created_at, anchor_id)
+            stmt = stmt.where(position > anchor if after_id is not None else position < anchor)
+
+        if after_id is not None:
+            stmt = stmt.order_by(model.created_at, model.id)
+        else:
+            stmt = stmt.order_by(model.created_at.desc(), model.id.desc())
+
+        return stmt.limit(limit + 1)
+
+    @staticmethod
+    def _needs_archive(hot_count: int, limit: int, after_id: Optional[int]) -> bool:
+        # Archived messages are older than every hot message of their conversation
+        # (the job moves by age and never the latest one), so a page walking back
+        # only reaches the archive when the hot tier runs out. Pages walking
+        # forward always probe it; that's an empty index range unless the anchor
+        # itself was archived
+        return after_id is not None or hot_count <= limit
+
+    @staticmethod
+    def _merge_tiers(hot: list, archived: list, limit: int, after_id: Optional[int]) -> list:
+        """Combine per-tier pages (messages or rows) into one, in page order"""
+        if not archived:
+            return hot
+        merged = sorted(hot + archived, key=lambda m: (m.created_at, m.id), reverse=after_id is None)
+        return merged[:limit + 1]
+
+    @staticmethod
+    def _to_page(messages: List[Message], limit: int, after_id: Optional[int]) -> Tuple[List[Message], bool]:
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after_id is None:
+            messages.reverse()
+        return messages, has_more
+
+    @staticmethod
+    def _new_message(
+        sender_id: int,
+        receiver_id: int,
+        message_type: MessageType,
+        content: Optional[str] = None,
+        file_path: Optional[str] = None
+    ) -> Message:
+        return Message(
             sender_id=sender_id,
-            receiver_id=message.receiver_id,
-            content=message.content,
-            message_type=message.message_type
+            receiver_id=receiver_id,
+            content=content,
+            message_type=message_type,
+            file_url=file_path
+        )
+
+    @staticmethod
+    def create_message(db: Session, message: MessageCreate, sender_id: int) -> Message:
+        db_message = MessageService._new_message(
+            sender_id, message.receiver_id, message.message_type, message.content
         )
         db.add(db_message)
+        db.flush()
+        ConversationService.record_message(db, db_message)
         db.commit()
         db.refresh(db_message)
         return db_message
-    
+
+    @staticmethod
+    async def create_message_async(db: AsyncSession, message: MessageCreate, sender_id: int) -> Message:
+        db_message = MessageService._new_message(
+            sender_id, message.receiver_id, message.message_type, message.content
+        )
+        db.add(db_message)
+        await db.flush()
+        await ConversationService.record_message_async(db, db_message)
+        await db.commit()
+        await db.refresh(db_message)
+        return db_message
+
+    @staticmethod
+    async def create_messages_async(
+        db: AsyncSession, messages: List[Tuple[MessageCreate, int]]
+    ) -> List[Message]:
+        """Insert (message, sender_id) pairs in a single transaction"""
+        db_messages = [
+            MessageService._new_message(
+                sender_id, message.receiver_id, message.message_type, message.content
+            )
+            for message, sender_id in messages
+        ]
+        db.add_all(db_messages)
+        await db.flush()
+        for db_message in db_messages:
+            await ConversationService.record_message_async(db, db_message)
+        await db.commit()
+        return db_messages
+
+    @staticmethod
+    def get_message_by_id(db: Session, message_id: int) -> Optional[Message]:
+        """Hot or archived message (both have the same attributes)"""
+        return db.get(Message, message_id) or db.get(ArchivedMessage, message_id)
+
+    @staticmethod
+    async def get_message_by_id_async(db: AsyncSession, message_id: int) -> Optional[Message]:
+        return await db.get(Message, message_id) or await db.get(ArchivedMessage, message_id)
+
     @staticmethod
     def get_messages_between_users(db: Session, user1_id: int, user2_id: int) -> List[Message]:
-        return db.query(Message).filter(
-            ((Message.sender_id == user1_id) & (Message.receiver_id == user2_id)) |
-            ((Message.sender_id == user2_id) & (Message.receiver_id == user1_id))
-        ).order_by(Message.created_at).all()
-    
+        messages = []
+        for model in reversed(TIERS):
+            stmt = MessageService._conversation_stmt(user1_id, user2_id, model).order_by(
+                model.created_at, model.id
+            )
+            messages.extend(db.scalars(stmt))
+        return messages
+
+    @staticmethod
+    def get_conversation_page(
+        db: Session,
+        user1_id: int,
+        user2_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> Tuple[List[Message], bool]:
+        """Return up to `limit` messages in chronological order and whether more exist
+        past the page (older for before_id/latest, newer for after_id)"""
+        def fetch(model):
+            return list(db.scalars(MessageService._conversation_page_stmt(
+                user1_id, user2_id, limit, before_id, after_id, model
+            )))
+
+        hot = fetch(Message)
+        archived = fetch(ArchivedMessage) if MessageService._needs_archive(len(hot), limit, after_id) else []
+        return MessageService._to_page(
+            MessageService._merge_tiers(hot, archived, limit, after_id), limit, after_id
+        )
+
+    @staticmethod
+    def get_conversation_rows(
+        db: Session,
+        user1_id: int,
+        user2_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> Tuple[List[Row], bool]:
+        """Same page as get_conversation_page, as MESSAGE_COLUMNS rows instead of
+        ORM objects (no identity map or attribute instrumentation)"""
+        def fetch(model):
+            stmt = MessageService._conversation_page_stmt(
+                user1_id, user2_id, limit, before_id, after_id, model
+            ).with_only_columns(*message_columns(model))
+            return list(db.execute(stmt))
+
+        hot = fetch(Message)
+        archived = fetch(ArchivedMessage) if MessageService._needs_archive(len(hot), limit, after_id) else []
+        return MessageService._to_page(
+            MessageService._merge_tiers(hot, archived, limit, after_id), limit, after_id
+        )
+
+    @staticmethod
+    async def get_conversation_page_async(
+        db: AsyncSession,
+        user1_id: int,
+        user2_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> Tuple[List[Message], bool]:
+        async def fetch(model):
+            return list(await db.scalars(MessageService._conversation_page_stmt(
+                user1_id, user2_id, limit, before_id, after_id, model
+            )))
+
+        hot = await fetch(Message)
+        archived = await fetch(ArchivedMessage) if MessageService._needs_archive(len(hot), limit, after_id) else []
+        return MessageService._to_page(
+            MessageService._merge_tiers(hot, archived, limit, after_id), limit, after_id
+        )
+
+    @staticmethod
+    async def get_received_after_async(
+        db: AsyncSession, user_id: int, after_id: int, limit: int
+    ) -> List[Tuple[Message, str]]:
+        """Messages received by a user with id > after_id, oldest first, with
+        the sender's username. Both tiers are read: a long-offline client can
+        resume from an archived id"""
+        rows = []
+        for model in TIERS:
+            stmt = (
+                select(model, User.username)
+                .join(User, User.id == model.sender_id)
+                .where(model.receiver_id == user_id, model.id > after_id)
+                .order_by(model.id)
+                .limit(limit)
+            )
+            rows.extend(tuple(row) for row in await db.execute(stmt))
+        rows.sort(key=lambda row: row[0].id)
+        return rows[:limit]
+
+    @staticmethod
+    def _user_messages_stmt(user_id: int, model, *columns):
+        return select(*(columns or (model,))).where(
+            (model.sender_id == user_id) | (model.receiver_id == user_id)
+        ).order_by(model.created_at.desc())
+
+    @staticmethod
+    def _newest_first(messages: list) -> list:
+        return sorted(messages, key=lambda m: (m.created_at, m.id), reverse=True)
+
     @staticmethod
     def get_user_messages(db: Session, user_id: int) -> List[Message]:
-        return db.query(Message).filter(
-            (Message.sender_id == user_id) | (Message.receiver_id == user_id)
-        ).order_by(Message.created_at.desc()).all()
-    
-    @staticmethod
-    async def save_uploaded_file(file: UploadFile, upload_dir: str) -> str:
-        """Save uploaded file and return file path"""
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
-        
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-        
-        return file_path
-    
+        messages = []
+        for model in TIERS:
+            messages.extend(db.scalars(MessageService._user_messages_stmt(user_id, model)))
+        return MessageService._newest_first(messages)
+
+    @staticmethod
+    def get_user_message_rows(db: Session, user_id: int) -> List[Row]:
+        rows = []
+        for model in TIERS:
+            rows.extend(db.execute(
+                MessageService._user_messages_stmt(user_id, model, *message_columns(model))
+            ))
+        return MessageService._newest_first(rows)
+
+    @staticmethod
+    def _upload_extension(file: UploadFile) -> str:
+        # Prefer the declared type so identical bytes map to the same blob path
+        extension = mimetypes.guess_extension(file.content_type or "") or ""
+        if not extension:
+            extension = os.path.splitext(file.filename or "")[1].lower()
+        return extension if _SAFE_EXTENSION.match(extension) else ""
+
+    @staticmethod
+    async def save_uploaded_file(
+        file: UploadFile,
+        upload_dir: str,
+        max_size: Optional[int] = None,
+        db: Optional[AsyncSession] = None
+    ) -> StoredFile:
+        """Store an upload by content hash and return where it lives.
+
+        A first pass hashes the (already spooled) upload chunk by chunk, enforcing
+        the size limit as bytes arrive (FileTooLargeError). If a blob with that
+        hash exists nothing is written; otherwise a second pass streams it to a
+        temp file that is atomically renamed into place. With `db`, an existing
+        blob is found by hash through its media_blobs row, whatever extension
+        it was first stored under.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise FileTooLargeError(f"File size exceeds {max_size} bytes")
+            digest.update(chunk)
+
+        sha256 = digest.hexdigest()
+        file_path = None
+        if db is not None:
+            file_path = await MediaService.get_blob_path_async(db, sha256)
+        if file_path is None:
+            file_path = blob_path(upload_dir, sha256, MessageService._upload_extension(file))
+        stored = StoredFile(file_path, sha256, size, file.content_type)
+
+        if await aiofiles.os.path.exists(file_path):
+            # Duplicate content: refresh mtime so garbage collection keeps the blob
+            await _utime(file_path)
+            UPLOAD_BYTES.labels("false").inc(size)
+            return stored
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        await file.seek(0)
+        try:
+            async with aiofiles.open(temp_path, 'wb') as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+            await aiofiles.os.replace(temp_path, file_path)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        UPLOAD_BYTES.labels("true").inc(size)
+        return stored
+
     @staticmethod
     def create_media_message(
-        db: Session, 
-        sender_id: int, 
-        receiver_id: int, 
-        file_path: str, 
+        db: Session,
+        sender_id: int,
+        receiver_id: int,
+        media: StoredFile,
         message_type: MessageType,
         content: Optional[str] = None
     ) -> Message:
-        db_message = Message(
-            sender_id=sender_id,
-            receiver_id=receiver_id,
-            content=content,
-            message_type=message_type,
-            file_url=file_path
+        # The blob row's path, which differs from media.path when the same bytes
+        # were first stored under another extension
+        file_path = MediaService.acquire(db, media)
+        db_message = MessageService._new_message(
+            sender_id, receiver_id, message_type, content, file_path
         )
         db.add(db_message)
+        db.flush()
+        ConversationService.record_message(db, db_message)
         db.commit()
         db.refresh(db_message)
-        return db_message
\ No newline at end of file
+        return db_message
+
+    @staticmethod
+    async def create_media_message_async(
+        db: AsyncSession,
+        sender_id: int,
+        receiver_id: int,
+        media: StoredFile,
+        message_type: MessageType,
+        content: Optional[str] = None
+    ) -> Message:
+        file_path = await MediaService.acquire_async(db, media)
+        db_message = MessageService._new_message(
+            sender_id, receiver_id, message_type, content, file_path
+        )
+        db.add(db_message)
+        await db.flush()
+        await ConversationService.record_message_async(db, db_message)
+        await db.commit()
+        await db.refresh(db_message)
+        return db_message
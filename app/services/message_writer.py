@@ -0,0 +1,148 @@
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.message import Message
+from app.schemas.message import MessageCreate
+from app.services.message_service import MessageService
+import asyncio
+
+
+class MessageWriterOverloaded(Exception):
+    """Too many messages are already waiting for a commit"""
+
+
+class MessageWriterClosed(MessageWriterOverloaded):
+    """The writer is shutting down; retry against another worker"""
+
+
+# Queued by stop(): everything ahead of it is committed before the loop exits
+_STOP = object()
+
+
+class MessageWriter:
+    """Group-commit writer shared by all WebSocket connections.
+
+    Messages submitted within `window_ms` of each other (up to `batch_size`)
+    are inserted in one transaction on one pooled connection, so open sockets
+    don't each hold a session and every chat line doesn't cost its own commit.
+    """
+
+    def __init__(self, batch_size: int, window_ms: int, max_pending: int = 5000):
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._closed = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        # Also called lazily so the queue and task belong to the serving event loop
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    def start(self):
+        self._closed = False
+        self._ensure_started()
+
+    async def stop(self):
+        """Stop taking messages, commit everything already queued (so no
+        submitter is left waiting), then end the writer loop"""
+        self._closed = True
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._queue.put_nowait(_STOP)
+        try:
+            await self._task
+        except Exception as e:
+            print(f"Message writer stopped with an error: {e}")
+        self._task = None
+        # Only reachable if the loop died: nothing will commit these any more
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP and not item[2].done():
+                item[2].set_exception(MessageWriterClosed())
+
+    def _admit(self, count: int):
+        if self._closed:
+            self.rejected += count
+            raise MessageWriterClosed()
+        self._ensure_started()
+        # Shed instead of letting commit latency grow without bound
+        if self._queue.qsize() + count > self.max_pending:
+            self.rejected += count
+            raise MessageWriterOverloaded()
+
+    async def submit(self, message: MessageCreate, sender_id: int) -> Message:
+        """Queue a message and wait until its batch commits; returns it with id and created_at"""
+        self._admit(1)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, sender_id, future))
+        return await future
+
+    async def submit_many(self, messages: List[Tuple[MessageCreate, int]]) -> List[Message]:
+        """Queue (message, sender_id) pairs in order and wait for all of them"""
+        self._admit(len(messages))
+        loop = asyncio.get_running_loop()
+        futures = []
+        for message, sender_id in messages:
+            future = loop.create_future()
+            self._queue.put_nowait((message, sender_id, future))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> Tuple[List[Tuple[MessageCreate, int, asyncio.Future]], bool]:
+        """Next batch, and whether stop() was reached while collecting it"""
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = loop.time() + self.window
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if not batch:
+                continue
+            try:
+                async with AsyncSessionLocal() as db:
+                    saved = await MessageService.create_messages_async(
+                        db, [(message, sender_id) for message, sender_id, _ in batch]
+                    )
+            except Exception as e:
+                print(f"Message batch of {len(batch)} failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), db_message in zip(batch, saved):
+                # The sender may have disconnected and cancelled its wait
+                if not future.done():
+                    future.set_result(db_message)
+
+
+message_writer = MessageWriter(
+    settings.message_batch_size,
+    settings.message_batch_window_ms,
+    settings.message_writer_max_pending
+)
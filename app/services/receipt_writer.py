@@ -0,0 +1,200 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.services.conversation_service import ConversationService
+from app.services.room_service import RoomService
+from app.websocket.connection_manager import manager
+import asyncio
+
+# Sentinel for "everything so far"; marks are clamped to the newest message
+LATEST = 2**31 - 1
+
+
+class TooManyPendingReceipts(Exception):
+    """The reader already has its limit of distinct receipts waiting to flush"""
+
+
+class _PendingReceipt:
+    __slots__ = ("read_id", "delivered_id", "waiters")
+
+    def __init__(self):
+        self.read_id = 0
+        self.delivered_id = 0
+        self.waiters: List[asyncio.Future] = []
+
+
+class ReceiptWriter:
+    """Coalescing writer for read and delivery receipts.
+
+    A receipt is a high-water mark, so every mark a user sends for the same
+    conversation within `window_ms` collapses into one pending entry (the
+    highest ids win). Each flush writes all pending entries in one
+    transaction, one row update per conversation side, then pushes the
+    stored marks to both participants through the connection manager.
+
+    Receipts aren't charged to the send budget, so each reader may hold at
+    most `max_pending_per_reader` distinct entries per window; marks for
+    anyone beyond that are refused until the next flush.
+    """
+
+    def __init__(self, window_ms: int, max_pending_per_reader: int = 100):
+        self.window = window_ms / 1000
+        self.max_pending_per_reader = max_pending_per_reader
+        self.coalesced = 0
+        self.flushed = 0
+        self.rejected = 0
+        self._pending: Dict[Tuple[int, int], _PendingReceipt] = {}
+        self._pending_per_reader: Counter = Counter()
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None
+
+    def _ensure_started(self):
+        # Also called lazily so the event and task belong to the serving event loop
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            if self._pending:
+                self._ready.set()
+
+    def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        """Cancel the flush loop, then write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+        if self._pending:
+            await self._flush(self._take())
+
+    async def mark(
+        self,
+        reader_id: int,
+        peer_id: int,
+        read_id: int = 0,
+        delivered_id: int = 0,
+        wait: bool = False
+    ):
+        """Advance the reader's marks in their conversation with peer_id; with
+        `wait`, return once the batch holding the mark has committed. Raises
+        TooManyPendingReceipts if the reader is at its pending limit"""
+        self._ensure_started()
+        key = (reader_id, peer_id)
+        receipt = self._pending.get(key)
+        if receipt is None:
+            if self._pending_per_reader[reader_id] >= self.max_pending_per_reader:
+                self.rejected += 1
+                raise TooManyPendingReceipts()
+            self._pending_per_reader[reader_id] += 1
+            receipt = self._pending[key] = _PendingReceipt()
+        else:
+            self.coalesced += 1
+        receipt.read_id = max(receipt.read_id, read_id)
+        receipt.delivered_id = max(receipt.delivered_id, delivered_id)
+        self._ready.set()
+
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            receipt.waiters.append(future)
+            await future
+
+    def _take(self) -> Dict[Tuple[int, int], _PendingReceipt]:
+        batch, self._pending = self._pending, {}
+        self._pending_per_reader = Counter()
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            # Let marks from chatty clients pile up before writing
+            await asyncio.sleep(self.window)
+            self._ready.clear()
+            # Shielded so stopping mid-flush still commits the batch
+            self._flushing = asyncio.ensure_future(self._flush(self._take()))
+            try:
+                await asyncio.shield(self._flushing)
+            finally:
+                if self._flushing.done():
+                    self._flushing = None
+
+    async def _store(self, db, receipts: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+        return await ConversationService.apply_receipts_async(db, receipts)
+
+    async def _publish(self, reader_id: int, peer_id: int, read_id: int, delivered_id: int):
+        payload = {
+            "type": "receipt",
+            "reader_id": reader_id,
+            "peer_id": peer_id,
+            "read_up_to_id": read_id,
+            "delivered_up_to_id": delivered_id,
+        }
+        # The peer sees its messages read; the reader's other devices clear
+        # their unread state. A newer receipt supersedes a queued one
+        await manager.broadcast_to_users(
+            payload, list({peer_id, reader_id}), coalesce_key=f"receipt:{reader_id}:{peer_id}"
+        )
+
+    async def _flush(self, batch: Dict[Tuple[int, int], _PendingReceipt]):
+        receipts = [
+            (reader_id, peer_id, receipt.read_id, receipt.delivered_id)
+            for (reader_id, peer_id), receipt in batch.items()
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                stored = await self._store(db, receipts)
+        except Exception as e:
+            print(f"Receipt batch of {len(batch)} failed: {e}")
+            for receipt in batch.values():
+                for future in receipt.waiters:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        self.flushed += len(receipts)
+        for receipt in batch.values():
+            for future in receipt.waiters:
+                # An HTTP client may have gone away and cancelled its wait
+                if not future.done():
+                    future.set_result(None)
+
+        for marks in stored:
+            await self._publish(*marks)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "rejected": self.rejected,
+        }
+
+
+class RoomReceiptWriter(ReceiptWriter):
+    """The same coalescing for group rooms, keyed by (reader_id, room_id).
+    Stored marks are pushed to the reader's own devices only; fanning every
+    member's receipt out to the whole room would cost members squared, so
+    the others read them from GET /rooms/{id}/members."""
+
+    async def _store(self, db, receipts: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+        return await RoomService.apply_receipts_async(db, receipts)
+
+    async def _publish(self, reader_id: int, room_id: int, read_id: int, delivered_id: int):
+        payload = {
+            "type": "room_receipt",
+            "room_id": room_id,
+            "read_up_to_id": read_id,
+            "delivered_up_to_id": delivered_id,
+        }
+        await manager.send_personal_message(payload, reader_id, coalesce_key=f"room_receipt:{room_id}")
+
+
+receipt_writer = ReceiptWriter(settings.receipt_batch_window_ms, settings.receipt_max_pending_per_reader)
+room_receipt_writer = RoomReceiptWriter(settings.receipt_batch_window_ms, settings.receipt_max_pending_per_reader)
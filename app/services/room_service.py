@@ -0,0 +1,252 @@
+from sqlalchemy import Integer, Row, bindparam, case, delete, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.database import dialect_insert
+from app.models.message import least, greatest
+from app.models.room import Room, RoomMember, RoomMessage
+from app.models.user import User
+from app.schemas.room import RoomMessageCreate
+from collections import Counter
+from typing import Iterable, List, Optional, Set, Tuple
+
+ROOM_MESSAGE_COLUMNS = (
+    RoomMessage.id,
+    RoomMessage.room_id,
+    RoomMessage.sender_id,
+    RoomMessage.content,
+    RoomMessage.message_type,
+    RoomMessage.file_url,
+    RoomMessage.created_at,
+)
+
+
+def room_delivery_payload(message: RoomMessage, sender_username: str) -> dict:
+    return {
+        "type": "room_message",
+        "id": message.id,
+        "room_id": message.room_id,
+        "sender_id": message.sender_id,
+        "sender_username": sender_username,
+        "message": message.content,
+        "message_type": message.message_type.value,
+        "timestamp": message.created_at.isoformat()
+    }
+
+
+class RoomService:
+    @staticmethod
+    def get_existing_user_ids(db: Session, user_ids: Iterable[int]) -> Set[int]:
+        return set(db.scalars(select(User.id).where(User.id.in_(list(user_ids)))))
+
+    @staticmethod
+    def _add_members(db: Session, room: Room, user_ids: Iterable[int]) -> None:
+        # One executemany; members who are already in the room are skipped. New
+        # members start caught up, so the room's history doesn't count as unread
+        stmt = dialect_insert(db.get_bind().dialect.name)(RoomMember).on_conflict_do_nothing(
+            index_elements=[RoomMember.room_id, RoomMember.user_id]
+        )
+        db.execute(stmt, [
+            {
+                "room_id": room.id,
+                "user_id": user_id,
+                "read_up_to_id": room.last_message_id,
+                "delivered_up_to_id": room.last_message_id,
+            }
+            for user_id in sorted(set(user_ids))
+        ])
+
+    @staticmethod
+    def create_room(db: Session, name: str, creator_id: int, member_ids: Iterable[int]) -> Room:
+        room = Room(name=name, created_by=creator_id, last_message_id=0)
+        db.add(room)
+        db.flush()
+        RoomService._add_members(db, room, {creator_id, *member_ids})
+        db.commit()
+        db.refresh(room)
+        return room
+
+    @staticmethod
+    def add_members(db: Session, room: Room, user_ids: Iterable[int]) -> None:
+        RoomService._add_members(db, room, user_ids)
+        db.commit()
+
+    @staticmethod
+    def remove_member(db: Session, room_id: int, user_id: int) -> bool:
+        result = db.execute(
+            delete(RoomMember).where(RoomMember.room_id == room_id, RoomMember.user_id == user_id)
+        )
+        db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    def get_room(db: Session, room_id: int) -> Optional[Room]:
+        return db.get(Room, room_id)
+
+    @staticmethod
+    def get_membership(db: Session, room_id: int, user_id: int) -> Optional[RoomMember]:
+        return db.get(RoomMember, (room_id, user_id))
+
+    @staticmethod
+    def count_members(db: Session, room_id: int) -> int:
+        return db.scalar(select(func.count()).select_from(RoomMember).where(RoomMember.room_id == room_id))
+
+    @staticmethod
+    def get_members(db: Session, room_id: int) -> List[RoomMember]:
+        return list(db.scalars(
+            select(RoomMember).where(RoomMember.room_id == room_id).order_by(RoomMember.user_id)
+        ))
+
+    @staticmethod
+    async def get_member_ids_async(db: AsyncSession, room_id: int) -> List[int]:
+        """Everyone in the room; a primary key range scan"""
+        return list(await db.scalars(select(RoomMember.user_id).where(RoomMember.room_id == room_id)))
+
+    @staticmethod
+    def get_user_rooms(db: Session, user_id: int) -> List[Tuple[Room, RoomMember]]:
+        """The user's rooms with their membership rows, most recently active first"""
+        stmt = (
+            select(Room, RoomMember)
+            .join(RoomMember, RoomMember.room_id == Room.id)
+            .where(RoomMember.user_id == user_id)
+            .order_by(Room.last_message_id.desc(), Room.id.desc())
+        )
+        return [tuple(row) for row in db.execute(stmt)]
+
+    @staticmethod
+    def _unread_statement():
+        """UPDATE counting new messages as unread for everyone in a room but
+        their sender, executed with one parameter set per (room, sender)"""
+        c = RoomMember.__table__.c
+        return update(RoomMember.__table__).where(
+            c.room_id == bindparam("target_room_id"),
+            c.user_id != bindparam("sender_id")
+        ).values({c.unread: c.unread + bindparam("count", type_=Integer)})
+
+    @staticmethod
+    def _last_message_statement():
+        c = Room.__table__.c
+        return update(Room.__table__).where(c.id == bindparam("target_room_id")).values({
+            c.last_message_id: greatest(c.last_message_id, bindparam("message_id", type_=Integer))
+        })
+
+    @staticmethod
+    async def create_room_messages_async(
+        db: AsyncSession, messages: List[Tuple[int, RoomMessageCreate, int]]
+    ) -> List[RoomMessage]:
+        """Insert (room_id, message, sender_id) triples in a single transaction.
+
+        Each message is one row however large its room. Member state is then
+        updated with an executemany per table, one parameter set per room and
+        sender, so the number of statements doesn't grow with the membership.
+        """
+        db_messages = [
+            RoomMessage(
+                room_id=room_id,
+                sender_id=sender_id,
+                content=message.content,
+                message_type=message.message_type
+            )
+            for room_id, message, sender_id in messages
+        ]
+        db.add_all(db_messages)
+        await db.flush()
+
+        counts = Counter((m.room_id, m.sender_id) for m in db_messages)
+        await db.execute(RoomService._unread_statement(), [
+            {"target_room_id": room_id, "sender_id": sender_id, "count": count}
+            for (room_id, sender_id), count in counts.items()
+        ])
+        last_ids = {}
+        for m in db_messages:
+            last_ids[m.room_id] = max(last_ids.get(m.room_id, 0), m.id)
+        await db.execute(RoomService._last_message_statement(), [
+            {"target_room_id": room_id, "message_id": message_id} for room_id, message_id in last_ids.items()
+        ])
+        await db.commit()
+        return db_messages
+
+    @staticmethod
+    def get_room_rows(
+        db: Session,
+        room_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> Tuple[List[Row], bool]:
+        """Up to `limit` messages in chronological order and whether more exist
+        past the page (older for before_id/latest, newer for after_id). Room
+        message ids only grow, so the id alone orders the history"""
+        stmt = select(*ROOM_MESSAGE_COLUMNS).where(RoomMessage.room_id == room_id)
+        if after_id is not None:
+            stmt = stmt.where(RoomMessage.id > after_id).order_by(RoomMessage.id)
+        else:
+            if before_id is not None:
+                stmt = stmt.where(RoomMessage.id < before_id)
+            stmt = stmt.order_by(RoomMessage.id.desc())
+
+        rows = list(db.execute(stmt.limit(limit + 1)))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after_id is None:
+            rows.reverse()
+        return rows, has_more
+
+    @staticmethod
+    def _receipt_statement():
+        """UPDATE for members' marks, executed with many parameter sets
+        (reader_id, room_id, read_id, delivered_id)"""
+        c = RoomMember.__table__.c
+        # Correlated explicitly: it is also nested inside the unread recount below
+        last_message_id = (
+            select(Room.last_message_id).where(Room.id == c.room_id).correlate(RoomMember.__table__).scalar_subquery()
+        )
+
+        # Marks only move forward and never past the room's newest message
+        read_id = least(greatest(c.read_up_to_id, bindparam("read_id", type_=Integer)), last_message_id)
+        still_unread = select(func.count()).select_from(RoomMessage).where(
+            RoomMessage.room_id == c.room_id,
+            RoomMessage.sender_id != c.user_id,
+            RoomMessage.id > read_id
+        ).scalar_subquery()
+        return update(RoomMember.__table__).where(
+            c.user_id == bindparam("reader_id"),
+            c.room_id == bindparam("target_room_id")
+        ).values({
+            c.read_up_to_id: read_id,
+            # Reading implies delivery
+            c.delivered_up_to_id: greatest(
+                c.delivered_up_to_id,
+                least(bindparam("delivered_id", type_=Integer), last_message_id),
+                read_id
+            ),
+            # Counted only when the read mark moves and stops short of the newest message
+            c.unread: case(
+                (read_id >= last_message_id, 0),
+                (read_id > c.read_up_to_id, still_unread),
+                else_=c.unread
+            ),
+        })
+
+    @staticmethod
+    async def apply_receipts_async(
+        db: AsyncSession, receipts: List[Tuple[int, int, int, int]]
+    ) -> List[Tuple[int, int, int, int]]:
+        """Advance (reader_id, room_id, read_id, delivered_id) marks in one
+        transaction. Returns the stored marks in the same shape for members"""
+        await db.execute(RoomService._receipt_statement(), [
+            {"reader_id": reader_id, "target_room_id": room_id, "read_id": read_id, "delivered_id": delivered_id}
+            for reader_id, room_id, read_id, delivered_id in receipts
+        ])
+        rows = {
+            (row.user_id, row.room_id): row
+            for row in await db.execute(
+                select(RoomMember.user_id, RoomMember.room_id, RoomMember.read_up_to_id, RoomMember.delivered_up_to_id)
+                .where(tuple_(RoomMember.user_id, RoomMember.room_id).in_([r[:2] for r in receipts]))
+            )
+        }
+        await db.commit()
+        return [
+            (reader_id, room_id, row.read_up_to_id, row.delivered_up_to_id)
+            for reader_id, room_id, _, _ in receipts
+            if (row := rows.get((reader_id, room_id))) is not None
+        ]
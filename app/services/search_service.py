@@ -0,0 +1,120 @@
+from sqlalchemy import Float, String, column, text
+from sqlalchemy.orm import Session
+from app.models.message import Message
+from typing import List, Optional, Tuple
+import re
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# The indexes queried here (FTS5 messages_fts on SQLite, content_tsv columns on
+# PostgreSQL) are created by migrations 0001 and 0002
+
+# Lower scores rank first on both backends (bm25 is negative, ts_rank_cd is negated).
+# Scores depend on corpus-wide statistics and shift whenever messages are
+# written or archived, so pages are positions in the ranking (OFFSET), never
+# score thresholds, and only the top max_results hits can be paged through
+_SQLITE_TIER = """
+    SELECT m.id, m.sender_id, m.receiver_id, m.content, m.message_type, m.file_url, m.created_at,
+           hit.score, hit.highlight
+    FROM hit
+    JOIN {table} AS m ON m.id = hit.id
+"""
+
+# The hit CTE is used by both tiers, so SQLite materializes it (one MATCH)
+SQLITE_SEARCH = f"""
+WITH hit AS (
+    SELECT rowid AS id, bm25(messages_fts, 1.0, 0.0) AS score,
+           snippet(messages_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 24) AS highlight
+    FROM messages_fts
+    WHERE messages_fts MATCH :match
+)
+SELECT * FROM ({_SQLITE_TIER.format(table="messages")}
+    UNION ALL{_SQLITE_TIER.format(table="messages_archive")}
+) AS page
+ORDER BY page.score, page.id
+LIMIT :limit OFFSET :offset
+"""
+
+_POSTGRES_TIER = """
+        SELECT m.id, m.sender_id, m.receiver_id, m.content, m.message_type, m.file_url,
+               m.created_at, -ts_rank_cd(m.content_tsv, q) AS score
+        FROM {table} AS m, websearch_to_tsquery('simple', :query) AS q
+        WHERE m.content_tsv @@ q AND (m.sender_id = :user_id OR m.receiver_id = :user_id)
+"""
+
+POSTGRES_SEARCH = f"""
+SELECT page.*,
+       ts_headline('simple', page.content, websearch_to_tsquery('simple', :query),
+                   'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=35, MinWords=15')
+       AS highlight
+FROM (
+    SELECT * FROM ({_POSTGRES_TIER.format(table="messages")}
+        UNION ALL{_POSTGRES_TIER.format(table="messages_archive")}
+    ) AS scored
+    ORDER BY scored.score, scored.id
+    LIMIT :limit OFFSET :offset
+) AS page
+ORDER BY page.score, page.id
+"""
+
+_TERM = re.compile(r"\w+\*?")
+
+
+def _fts5_query(query: str) -> Optional[str]:
+    # Quote each term so user input can't inject FTS5 operators; a trailing *
+    # keeps its prefix-match meaning
+    terms = []
+    for term in _TERM.findall(query):
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    return " ".join(terms) if terms else None
+
+
+class SearchService:
+    @staticmethod
+    def search(
+        db: Session,
+        user_id: int,
+        query: str,
+        limit: int,
+        offset: int = 0,
+        max_results: int = 200
+    ) -> Tuple[List, bool]:
+        """Rank the caller's messages matching `query`, best first.
+
+        Rows carry the MessageResponse columns plus `score` and `highlight`.
+        Returns hits [offset, offset + limit) of the ranking, cut off at
+        `max_results`; pagination is best-effort, as messages written or
+        archived between pages can move hits across page boundaries.
+        """
+        limit = min(limit, max_results - offset)
+        if limit <= 0:
+            return [], False
+        params = {"offset": offset, "limit": limit + 1}
+
+        if db.get_bind().dialect.name == "sqlite":
+            match = _fts5_query(query)
+            if match is None:
+                return [], False
+            sql = SQLITE_SEARCH
+            params["match"] = f'participants : "u{user_id}" AND content : ({match})'
+        else:
+            sql = POSTGRES_SEARCH
+            params.update(query=query, user_id=user_id)
+
+        stmt = text(sql).columns(
+            Message.id,
+            Message.sender_id,
+            Message.receiver_id,
+            Message.content,
+            Message.message_type,
+            Message.file_url,
+            Message.created_at,
+            column("score", Float),
+            column("highlight", String),
+        )
+        rows = list(db.execute(stmt, params))
+        has_more = len(rows) > limit and offset + limit < max_results
+        return rows[:limit], has_more
@@ -0,0 +1,188 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from app.core.config import settings
+
+# Output formats: {query value: (Pillow format, extension, media type)}
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+# Bound used for an unconstrained side when only one of w/h is given
+MAX_DIMENSION = 4096
+
+
+class SourceImageTooLarge(Exception):
+    """The source has more pixels than a render worker will decode"""
+
+
+def _render_thumbnail(
+    source_path: str, dest_path: str, width: int, height: int, pil_format: str, max_pixels: int
+):
+    # Runs in a worker process; Pillow is imported there, not at app import time
+    from PIL import Image, ImageOps
+
+    # A small file can declare a huge canvas; check the header before decoding
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        source = Image.open(source_path)
+    except Image.DecompressionBombError as e:
+        raise SourceImageTooLarge(str(e))
+    with source as image:
+        if image.width * image.height > max_pixels:
+            raise SourceImageTooLarge(f"{image.width}x{image.height} exceeds {max_pixels} pixels")
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, height))
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        temp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+        image.save(temp_path, pil_format)
+    os.replace(temp_path, dest_path)
+
+
+def _load_pillow() -> int:
+    # Warm-up task: import Pillow in a worker ahead of its first render
+    from PIL import Image, ImageOps  # noqa: F401
+    return os.getpid()
+
+
+class ThumbnailCache:
+    """Resized image derivatives rendered in a process pool and cached on disk.
+
+    Derivatives are keyed by source path, size and format. The cache directory
+    is trimmed least-recently-used first (by mtime, refreshed on hits) once it
+    grows past `max_bytes`. Filesystem work runs on the threadpool, never on
+    the event loop.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, workers: int, max_source_pixels: int = 64000000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_source_pixels = max_source_pixels
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._size: Optional[int] = None
+        self._size_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _cache_path(self, source_path: str, width: int, height: int, fmt: str) -> str:
+        source = os.path.realpath(source_path)
+        key = hashlib.sha256(f"{source}|{width}x{height}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}{THUMBNAIL_FORMATS[fmt][1]}")
+
+    async def get(self, source_path: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+        """Return the path of a derivative no larger than width x height"""
+        width = width or MAX_DIMENSION
+        height = height or MAX_DIMENSION
+        path = self._cache_path(source_path, width, height, fmt)
+
+        if await run_in_threadpool(self._touch, path):
+            return path
+
+        # Concurrent requests for the same derivative share one render
+        future = self._inflight.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self._render(source_path, path, width, height, fmt))
+            self._inflight[path] = future
+            future.add_done_callback(lambda _: self._inflight.pop(path, None))
+        await asyncio.shield(future)
+        return path
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        # A hit refreshes the mtime that eviction orders by
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def _render(self, source_path: str, path: str, width: int, height: int, fmt: str):
+        await run_in_threadpool(os.makedirs, self.cache_dir, exist_ok=True)
+        executor = self._get_executor()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                executor, _render_thumbnail,
+                source_path, path, width, height, THUMBNAIL_FORMATS[fmt][0], self.max_source_pixels
+            )
+        except BrokenProcessPool:
+            # A worker died mid-render (e.g. killed for memory); the pool can't
+            # be reused, so later renders get a fresh one
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False)
+            raise
+        await run_in_threadpool(self._added, path)
+
+    def _added(self, path: str):
+        self._evict(os.path.getsize(path))
+
+    def _scan_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir))
+
+    async def warm_up(self):
+        """Fork the render workers with Pillow loaded and size the cache
+        directory, so the first thumbnail request does neither"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, _load_pillow) for _ in range(self.workers)
+        ))
+        if os.path.isdir(self.cache_dir):
+            self._size = await asyncio.to_thread(self._scan_size)
+
+    def _evict(self, added_bytes: int):
+        # Renders finish on several threadpool threads at once
+        with self._size_lock:
+            self._evict_locked(added_bytes)
+
+    def _evict_locked(self, added_bytes: int):
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += added_bytes
+        if self._size <= self.max_bytes:
+            return
+
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        # Trim to 90% so eviction doesn't run on every new derivative
+        target = self.max_bytes * 0.9
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+thumbnail_cache = ThumbnailCache(
+    settings.thumbnail_cache_dir,
+    settings.thumbnail_cache_max_bytes,
+    settings.thumbnail_workers,
+    settings.thumbnail_max_source_pixels
+)
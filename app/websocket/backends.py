@@ -0,0 +1,142 @@
+from typing import Awaitable, Callable, List, Set
+import asyncio
+import atexit
+import json
+import os
+import socket
+import time
+import uuid
+
+# Called with (message, user_ids) to deliver to this process's sockets
+DeliverCallback = Callable[[dict, List[int]], Awaitable[None]]
+
+# Linux caps AF_UNIX datagrams at the socket send buffer (~208KB by default)
+MAX_DATAGRAM_SIZE = 65536
+# Recipients per datagram, so a large room's id list still fits
+MAX_USERS_PER_DATAGRAM = 2000
+PEER_REFRESH_SECONDS = 1.0
+
+
+class PubSubBackend:
+    """Delivers WebSocket messages to users connected to other worker processes"""
+
+    # Whether every socket lives in this process, so its connections alone say
+    # who is online
+    single_process = True
+
+    async def start(self, deliver: DeliverCallback):
+        pass
+
+    async def publish(self, message: dict, user_ids: List[int]):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InMemoryBackend(PubSubBackend):
+    """Single-process backend: every socket lives in this process, so there is
+    nothing to publish"""
+
+
+class UnixSocketBackend(PubSubBackend):
+    """Multi-process backend over a local Unix datagram bus.
+
+    Each worker binds one socket in `bus_dir`. A delivery is published to every
+    peer socket in the directory, once for all its recipients, and each peer
+    routes it by user id to its own connections (skipping users who aren't
+    connected there).
+    """
+
+    single_process = False
+
+    def __init__(self, bus_dir: str):
+        self.bus_dir = bus_dir
+        self.address = os.path.join(bus_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self._sock = None
+        self._deliver = None
+        self._peers: List[str] = []
+        self._peers_loaded_at = 0.0
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self, deliver: DeliverCallback):
+        os.makedirs(self.bus_dir, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(self.address)
+        self._sock = sock
+        self._deliver = deliver
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        atexit.register(self._unlink)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self._sock.recv(MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            try:
+                envelope = json.loads(data)
+            except ValueError:
+                print("Dropping malformed bus datagram")
+                continue
+            task = asyncio.create_task(self._deliver(envelope["message"], envelope["user_ids"]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _peer_addresses(self) -> List[str]:
+        now = time.monotonic()
+        if now - self._peers_loaded_at > PEER_REFRESH_SECONDS:
+            self._peers = [
+                os.path.join(self.bus_dir, name)
+                for name in os.listdir(self.bus_dir)
+                if name.endswith(".sock") and os.path.join(self.bus_dir, name) != self.address
+            ]
+            self._peers_loaded_at = now
+        return self._peers
+
+    async def publish(self, message: dict, user_ids: List[int]):
+        for start in range(0, len(user_ids), MAX_USERS_PER_DATAGRAM):
+            chunk = user_ids[start:start + MAX_USERS_PER_DATAGRAM]
+            data = json.dumps({"user_ids": chunk, "message": message}).encode()
+            if len(data) > MAX_DATAGRAM_SIZE:
+                print(f"Delivery for {len(chunk)} users exceeds bus datagram size, not published")
+                continue
+
+            for peer in list(self._peer_addresses()):
+                try:
+                    self._sock.sendto(data, peer)
+                except BlockingIOError:
+                    print(f"Bus peer {peer} is backlogged, dropping delivery for {len(chunk)} users")
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Worker exited without cleaning up its socket file
+                    self._remove_peer(peer)
+
+    def _remove_peer(self, peer: str):
+        if peer in self._peers:
+            self._peers.remove(peer)
+        try:
+            os.unlink(peer)
+        except FileNotFoundError:
+            pass
+
+    def _unlink(self):
+        try:
+            os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    async def stop(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        self._unlink()
+
+
+def create_backend(name: str, bus_dir: str) -> PubSubBackend:
+    if name == "memory":
+        return InMemoryBackend()
+    if name == "unix":
+        return UnixSocketBackend(bus_dir)
+    raise ValueError(f"Unknown WebSocket backend: {name}")
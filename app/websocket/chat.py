@@ -1,87 +1,367 @@
-from fastapi import WebSocket, WebSocketDisconnect, Depends, Query
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from fastapi import WebSocket, WebSocketDisconnect, Query
+from pydantic import ValidationError
+from typing import List, Optional
+from app.core.config import settings
+from app.core.database import AsyncReadSessionLocal, AsyncSessionLocal
+from app.core.rate_limit import retry_after
 from app.core.security import verify_token
 from app.services.auth_service import AuthService
 from app.services.message_service import MessageService
+from app.services.message_writer import message_writer
+from app.services.receipt_writer import receipt_writer, room_receipt_writer, TooManyPendingReceipts
+from app.services.room_service import RoomService, room_delivery_payload
+from app.services.conversation_service import ConversationService
+from app.api.dependencies import send_limiter
 from app.schemas.message import MessageCreate
-from app.models.message import MessageType
+from app.schemas.room import RoomMessageCreate
+from app.models.message import Message, MessageType
 from .connection_manager import manager
-import json
+from .outbound import ClientConnection, CLOSE_RATE_LIMITED
+
+
+def _delivery_payload(message: Message, sender_username: str) -> dict:
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "sender_username": sender_username,
+        "receiver_id": message.receiver_id,
+        "message": message.content,
+        "message_type": message.message_type.value,
+        "timestamp": message.created_at.isoformat()
+    }
+
+
+async def _replay_missed(connection: ClientConnection, user_id: int, last_seen_id: int):
+    """Stream messages received after last_seen_id, then switch to live delivery.
+
+    The connection is registered (paused) before the first read, so anything
+    committed later arrives live; live frames the replay already covered are
+    dropped on resume. Each batch borrows a session only for its query, on
+    the primary: a lagging replica could miss messages committed just before
+    the disconnect, and they would never be replayed.
+    """
+    replayed_through = last_seen_id
+    replayed = 0
+    truncated = False
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = await MessageService.get_received_after_async(
+                db, user_id, replayed_through, settings.ws_resume_batch_size
+            )
+        if rows:
+            # One frame per batch on the binary protocol
+            await connection.send_now([
+                _delivery_payload(message, sender_username) for message, sender_username in rows
+            ])
+            replayed_through = rows[-1][0].id
+        replayed += len(rows)
+        
+        if len(rows) < settings.ws_resume_batch_size:
+            if not connection.overflowed:
+                break
+            # Live frames were dropped from the buffer meanwhile; read them from the DB
+            connection.overflowed = False
+        elif replayed >= settings.ws_resume_max_messages:
+            truncated = True
+            break
+    
+    # No await between the last check and resume, so no frame can slip past
+    connection.resume(replayed_through, {
+        "status": "resumed",
+        "last_message_id": replayed_through,
+        "replayed": replayed,
+        "truncated": truncated
+    })
+
+
+def _reply(request: dict, reply: dict) -> dict:
+    # Echo the client's correlation id so replies to a batch can be matched up
+    if isinstance(request, dict) and "client_id" in request:
+        reply["client_id"] = request["client_id"]
+    return reply
+
+
+async def _handle_receipt(connection: ClientConnection, user, receipt: dict):
+    """Queue a read/delivered mark; marks are coalesced and stored in the background"""
+    # Marks for a room carry room_id instead of the peer's user_id
+    writer, target = receipt_writer, "user_id"
+    if "room_id" in receipt:
+        writer, target = room_receipt_writer, "room_id"
+    target_id, up_to_id = receipt.get(target), receipt.get("up_to_id")
+    if not isinstance(target_id, int) or not isinstance(up_to_id, int) or up_to_id < 1:
+        connection.push(_reply(receipt, {
+            "error": "Invalid receipt format. Required: type, user_id or room_id, up_to_id"
+        }))
+        return
+    try:
+        if receipt["type"] == "read":
+            await writer.mark(user.id, target_id, read_id=up_to_id)
+        else:
+            await writer.mark(user.id, target_id, delivered_id=up_to_id)
+    except TooManyPendingReceipts:
+        connection.push(_reply(receipt, {"error": "Too many pending receipts", "retry_after": 1}))
+
+
+async def _handle_presence(connection: ClientConnection, user, request: dict):
+    """(Un)subscribe from contacts' presence; a subscription is answered with
+    their current state and followed by diffs"""
+    user_ids = request.get("user_ids")
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, int) for user_id in user_ids):
+        connection.push(_reply(request, {
+            "error": "Invalid presence request. Required: type, user_ids"
+        }))
+        return
+    user_ids = set(user_ids)
+    if request["type"] == "unsubscribe_presence":
+        manager.unsubscribe_presence(connection, user_ids)
+        return
+    if not manager.presence_supported:
+        # Contacts on other workers would always look offline
+        connection.push(_reply(request, {"error": "Presence is not available with multiple workers"}))
+        return
+    if len(connection.presence | user_ids) > settings.ws_max_presence_subscriptions:
+        connection.push(_reply(request, {"error": "Too many presence subscriptions"}))
+        return
+    
+    # Only people the user has a conversation with; other ids are ignored
+    async with AsyncReadSessionLocal() as db:
+        contact_ids = await ConversationService.get_contact_ids_async(db, user.id, list(user_ids))
+    connection.push(_reply(request, manager.subscribe_presence(connection, contact_ids)))
+
+
+async def _handle_control(connection: ClientConnection, user, requests: List[dict]) -> List[dict]:
+    """Handle the frame's receipts, pongs and presence requests; returns the
+    chat messages left over"""
+    messages = []
+    for request in requests:
+        kind = request.get("type") if isinstance(request, dict) else None
+        if kind in ("read", "delivered"):
+            await _handle_receipt(connection, user, request)
+        elif kind in ("subscribe_presence", "unsubscribe_presence"):
+            await _handle_presence(connection, user, request)
+        elif kind != "pong":
+            # Pongs need no handling: any inbound frame resets the idle timer
+            messages.append(request)
+    return messages
+
+
+async def _handle_room_messages(connection: ClientConnection, user, requests: List[dict]):
+    """Save one frame's room messages in one transaction, then fan each out to
+    the room's other members; only online ones have sockets to queue on"""
+    members = {}
+    accepted = []
+    for message_data in requests:
+        room_id = message_data["room_id"]
+        if not isinstance(room_id, int):
+            connection.push(_reply(message_data, {"error": "Invalid room_id"}))
+            continue
+        # Validated one by one, so a bad message is rejected on its own
+        try:
+            message = RoomMessageCreate(content=message_data["message"])
+        except ValidationError:
+            connection.push(_reply(message_data, {"error": "Invalid message: must be a string"}))
+            continue
+        if room_id not in members:
+            # On the primary, so a room created just before is found
+            async with AsyncSessionLocal() as db:
+                members[room_id] = await RoomService.get_member_ids_async(db, room_id)
+        if user.id not in members[room_id]:
+            connection.push(_reply(message_data, {"error": "Room not found"}))
+            continue
+        accepted.append((message_data, message))
+    
+    if not accepted:
+        return
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            saved_messages = await RoomService.create_room_messages_async(db, [
+                (message_data["room_id"], message, user.id) for message_data, message in accepted
+            ])
+    except Exception as e:
+        print(f"Room message batch of {len(accepted)} failed: {e}")
+        for message_data, _ in accepted:
+            connection.push(_reply(message_data, {"error": "Server busy, please retry", "retry_after": 1}))
+        return
+    
+    for saved_message in saved_messages:
+        await manager.broadcast_to_users(
+            room_delivery_payload(saved_message, user.username),
+            [member_id for member_id in members[saved_message.room_id] if member_id != user.id]
+        )
+    
+    for (message_data, _), saved_message in zip(accepted, saved_messages):
+        connection.push(_reply(message_data, {
+            "status": "sent",
+            "room_id": saved_message.room_id,
+            "message_id": saved_message.id,
+            "timestamp": saved_message.created_at.isoformat()
+        }))
+
+
+async def _handle_messages(connection: ClientConnection, user, requests: List[dict]):
+    """Save and deliver one inbound frame's messages; a batch commits together"""
+    room_messages = [
+        message_data for message_data in requests
+        if isinstance(message_data, dict) and "room_id" in message_data and "message" in message_data
+    ]
+    if room_messages:
+        await _handle_room_messages(connection, user, room_messages)
+        requests = [message_data for message_data in requests if message_data not in room_messages]
+    
+    accepted = []
+    for message_data in requests:
+        # Validate message structure
+        if not isinstance(message_data, dict) or "receiver_id" not in message_data or "message" not in message_data:
+            connection.push(_reply(message_data, {
+                "error": "Invalid message format. Required: receiver_id, message"
+            }))
+            continue
+        # Validated one by one, so a bad message is rejected on its own
+        try:
+            message = MessageCreate(
+                receiver_id=message_data["receiver_id"],
+                content=message_data["message"],
+                message_type=MessageType.TEXT
+            )
+        except ValidationError:
+            connection.push(_reply(message_data, {
+                "error": "Invalid message: receiver_id must be an integer and message a string"
+            }))
+            continue
+        
+        # Verify receiver exists, on the primary so users who just signed up are found
+        async with AsyncSessionLocal() as db:
+            receiver = await AuthService.get_user_by_id_cached_async(db, message.receiver_id)
+        if not receiver:
+            connection.push(_reply(message_data, {
+                "error": "Receiver not found"
+            }))
+            continue
+        accepted.append((message_data, message))
+    
+    if not accepted:
+        return
+    
+    # Save messages to database
+    try:
+        saved_messages = await message_writer.submit_many([(message, user.id) for _, message in accepted])
+    except Exception:
+        # Shed (MessageWriterOverloaded), or the batch this frame joined failed
+        # to commit and the writer logged why; the socket stays open either way
+        for message_data, _ in accepted:
+            connection.push(_reply(message_data, {"error": "Server busy, please retry", "retry_after": 1}))
+        return
+    
+    # Send to receivers (if online)
+    await manager.send_many([
+        (_delivery_payload(saved_message, user.username), saved_message.receiver_id)
+        for saved_message in saved_messages
+    ])
+    
+    # Confirmations are queued back to back, so the binary protocol sends them as one frame
+    for (message_data, _), saved_message in zip(accepted, saved_messages):
+        connection.push(_reply(message_data, {
+            "status": "sent",
+            "message_id": saved_message.id,
+            "timestamp": saved_message.created_at.isoformat()
+        }))
 
 
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...),
-    db: Session = Depends(get_db)
+    last_seen_id: Optional[int] = Query(None, ge=0),
+    heartbeat: bool = Query(False)
 ):
+    """DB sessions are borrowed per lookup and inserts go through the shared
+    group-commit writer, so an idle socket holds no pooled connection.
+
+    A reconnecting client passes the last message id it received as
+    `last_seen_id`; missed messages are replayed before live delivery resumes.
+
+    Clients offering the `chat.msgpack.v1` subprotocol exchange binary frames,
+    each a MessagePack array of messages, acks or errors; others get one JSON
+    object per text frame. An optional `client_id` on a message is echoed in
+    its ack or error. A message with `room_id` instead of `receiver_id` goes
+    to everyone in that room, as `{"type": "room_message", ...}` frames.
+    
+    Besides messages, a frame may carry receipts: `{"type": "read" | "delivered",
+    "user_id": <peer>, "up_to_id": <message id>}`. They get no ack; stored marks
+    come back to both participants as `{"type": "receipt", ...}` frames. Room
+    receipts carry `room_id` instead and come back as `room_receipt` frames to
+    the reader's own sockets.
+    
+    Clients connecting with `heartbeat=true` get `{"type": "ping"}` after the
+    heartbeat interval of silence and are closed (4408) once silent past the
+    idle timeout; any frame, e.g. `{"type": "pong"}`, keeps them alive. Other
+    clients only get the server's protocol-level WebSocket pings.
+    `{"type": "subscribe_presence", "user_ids": [...]}` answers with a
+    `{"type": "presence", "online": [...], "offline": [...]}` snapshot of
+    the user's contacts among them, and later frames of the same shape carry
+    only changes. Presence needs the single-worker `memory` backend.
+    """
     # Verify token and get user
     user_id = verify_token(token)
     if not user_id:
         await websocket.close(code=4001, reason="Invalid token")
         return
     
-    user = AuthService.get_user_by_id(db, int(user_id))
+    async with AsyncSessionLocal() as db:
+        user = await AuthService.get_user_by_id_cached_async(db, int(user_id))
     if not user:
         await websocket.close(code=4001, reason="User not found")
         return
     
-    await manager.connect(websocket, user.id)
+    # Replies go through the connection's queue too, so all writes to the
+    # socket come from its single writer task
+    connection = await manager.connect(
+        websocket, user.id, paused=last_seen_id is not None, heartbeat=heartbeat
+    )
     
     try:
+        if last_seen_id is not None:
+            await _replay_missed(connection, user.id, last_seen_id)
+        
+        # Consecutive frames rejected by the rate limiter
+        violations = 0
+        
         while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Validate message structure
-            if "receiver_id" not in message_data or "message" not in message_data:
-                await websocket.send_text(json.dumps({
-                    "error": "Invalid message format. Required: receiver_id, message"
-                }))
+            # Receive a frame from the client; a binary frame may carry many messages
+            if connection.codec.binary:
+                data = await websocket.receive_bytes()
+            else:
+                data = await websocket.receive_text()
+            connection.touch()
+            try:
+                requests = connection.codec.decode(data)
+            except ValueError:
+                connection.push({"error": "Malformed frame"})
                 continue
             
-            receiver_id = message_data["receiver_id"]
-            message_content = message_data["message"]
-            message_type = message_data.get("message_type", "text")
-            
-            # Verify receiver exists
-            receiver = AuthService.get_user_by_id(db, receiver_id)
-            if not receiver:
-                await websocket.send_text(json.dumps({
-                    "error": "Receiver not found"
-                }))
+            # Control frames aren't charged to the send budget
+            requests = await _handle_control(connection, user, requests)
+            if not requests:
                 continue
             
-            # Save message to database
-            message_create = MessageCreate(
-                receiver_id=receiver_id,
-                content=message_content,
-                message_type=MessageType.TEXT if message_type == "text" else MessageType.TEXT
-            )
-            
-            saved_message = MessageService.create_message(db, message_create, user.id)
-            
-            # Prepare message for real-time delivery
-            real_time_message = {
-                "id": saved_message.id,
-                "sender_id": user.id,
-                "sender_username": user.username,
-                "receiver_id": receiver_id,
-                "message": message_content,
-                "message_type": message_type,
-                "timestamp": saved_message.created_at.isoformat()
-            }
+            # A frame bigger than the whole burst could never be admitted, so
+            # it is refused outright rather than counted as a violation
+            if send_limiter.rate > 0 and len(requests) > send_limiter.burst:
+                connection.push({"error": f"At most {send_limiter.burst} messages per frame"})
+                continue
             
-            # Send to receiver (if online)
-            await manager.send_personal_message(real_time_message, receiver_id)
+            # Every message in the frame is charged to the user's send budget
+            wait = send_limiter.acquire(user.id, len(requests))
+            if wait:
+                violations += 1
+                if violations >= settings.ws_max_rate_limit_violations:
+                    await connection.close(CLOSE_RATE_LIMITED, "Rate limit exceeded")
+                    return
+                connection.push({"error": "Rate limit exceeded", "retry_after": retry_after(wait)})
+                continue
+            violations = 0
             
-            # Send confirmation back to sender
-            await websocket.send_text(json.dumps({
-                "status": "sent",
-                "message_id": saved_message.id,
-                "timestamp": saved_message.created_at.isoformat()
-            }))
+            await _handle_messages(connection, user, requests)
             
     except WebSocketDisconnect:
         manager.disconnect(websocket, user.id)
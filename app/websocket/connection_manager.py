@@ -1,53 +1,269 @@
-from typing import Dict, List
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from fastapi import WebSocket
-import json
+from app.core.config import settings
+from .backends import PubSubBackend, InMemoryBackend, create_backend
+from .outbound import ClientConnection, CLOSE_IDLE
+from .protocol import negotiate
+import asyncio
+import time
 
 
 class ConnectionManager:
-    def __init__(self):
-        # Store active connections: {user_id: [websocket_connections]}
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    def __init__(
+        self,
+        backend: Optional[PubSubBackend] = None,
+        send_queue_size: int = 256,
+        slow_consumer_policy: str = "drop_oldest",
+        send_timeout: float = 10.0,
+        heartbeat_interval: float = 25.0,
+        idle_timeout: float = 75.0,
+        presence_window: float = 1.0
+    ):
+        if heartbeat_interval < 0 or idle_timeout < 0:
+            raise ValueError("Heartbeat interval and idle timeout must be 0 (disabled) or positive")
+        # Store active connections: {user_id: [connections]}
+        self.active_connections: Dict[int, List[ClientConnection]] = {}
+        # Reaches users whose sockets live in other worker processes
+        self.backend = backend or InMemoryBackend()
+        self._backend_started = False
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        # Outbound counters shared by all connections: enqueued, sent, dropped,
+        # coalesced, disconnected, send_errors; plus pings and reaped sockets
+        self.counters: Counter = Counter()
+        # Sockets that opted into heartbeats get a ping when silent for
+        # heartbeat_interval; silent past idle_timeout they are closed by the
+        # reaper. 0 disables either (an interval of 0 means no reaper at all).
+        # Other sockets are left to protocol-level pings
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._reaper: Optional[asyncio.Task] = None
+        # Closes started by the reaper, kept until done
+        self._tasks: Set[asyncio.Task] = set()
+        # Presence subscriptions: watched user -> subscribed connections. Changes
+        # are collected for presence_window and pushed as one diff per connection
+        self.presence_watchers: Dict[int, Set[ClientConnection]] = {}
+        self.presence_window = presence_window
+        self._presence_before: Dict[int, bool] = {}  # Online state when first changed this window
+        self._presence_flush: Optional[asyncio.Task] = None
     
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
+    async def _ensure_backend(self):
+        # Started at startup, or lazily, so the backend binds inside the serving event loop
+        if not self._backend_started:
+            self._backend_started = True
+            await self.backend.start(self._deliver_local)
+    
+    def _ensure_reaper(self):
+        if self.heartbeat_interval <= 0:
+            return
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+    
+    async def start(self):
+        await self._ensure_backend()
+        self._ensure_reaper()
+    
+    async def stop(self):
+        for task in (self._reaper, self._presence_flush):
+            if task is not None:
+                task.cancel()
+        self._reaper = self._presence_flush = None
+        if self._backend_started:
+            self._backend_started = False
+            await self.backend.stop()
+    
+    async def connect(
+        self, websocket: WebSocket, user_id: int, paused: bool = False, heartbeat: bool = False
+    ) -> ClientConnection:
+        """Register a socket; a paused connection buffers live frames until
+        `resume`. Only `heartbeat` sockets are pinged and reaped when idle"""
+        await self._ensure_backend()
+        codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        connection = ClientConnection(
+            websocket,
+            user_id,
+            self.send_queue_size,
+            self.slow_consumer_policy,
+            self.send_timeout,
+            self.counters,
+            self._remove,
+            codec
+        )
+        connection.heartbeat = heartbeat
+        connection.start(paused)
+        self._ensure_reaper()
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+            self._presence_changed(user_id, was_online=False)
+        self.active_connections[user_id].append(connection)
         print(f"User {user_id} connected. Total connections: {len(self.active_connections[user_id])}")
+        return connection
+    
+    def _remove(self, connection: ClientConnection):
+        self.unsubscribe_presence(connection, list(connection.presence))
+        connections = self.active_connections.get(connection.user_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+                self._presence_changed(connection.user_id, was_online=True)
+    
+    async def _reap(self):
+        """Ping quiet sockets and close dead ones. A half-open connection (a
+        phone that lost coverage) never fails a send, so silence is the only
+        signal that it's gone. Clients that didn't opt in may not know pings,
+        so their silence proves nothing and they are skipped"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval / 2)
+            now = time.monotonic()
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    if not connection.heartbeat:
+                        continue
+                    idle = now - connection.last_seen
+                    if self.idle_timeout and idle > self.idle_timeout:
+                        self.counters["reaped"] += 1
+                        task = asyncio.create_task(connection.close(CLOSE_IDLE, "Heartbeat timeout"))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    elif idle > self.heartbeat_interval and connection.last_ping < connection.last_seen:
+                        # Once per silence; the client answers {"type": "pong"}
+                        connection.last_ping = now
+                        self.counters["pings"] += 1
+                        connection.push({"type": "ping"}, coalesce_key="ping")
+    
+    @property
+    def presence_supported(self) -> bool:
+        # Presence is read from this worker's connections, which only tell the
+        # whole story when there is one worker
+        return self.backend.single_process
+    
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.active_connections
+    
+    def subscribe_presence(self, connection: ClientConnection, user_ids: Iterable[int]) -> dict:
+        """Watch users' presence; returns their current state as a presence frame"""
+        online, offline = [], []
+        for user_id in user_ids:
+            connection.presence.add(user_id)
+            self.presence_watchers.setdefault(user_id, set()).add(connection)
+            (online if self.is_online(user_id) else offline).append(user_id)
+        return {"type": "presence", "online": online, "offline": offline}
+    
+    def unsubscribe_presence(self, connection: ClientConnection, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            connection.presence.discard(user_id)
+            watchers = self.presence_watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(connection)
+                if not watchers:
+                    del self.presence_watchers[user_id]
+    
+    def _presence_changed(self, user_id: int, was_online: bool):
+        # Users nobody watches cost nothing; a user who reconnects within the
+        # window compares equal at flush time and produces no diff
+        if user_id not in self.presence_watchers:
+            return
+        self._presence_before.setdefault(user_id, was_online)
+        if self._presence_flush is None or self._presence_flush.done():
+            self._presence_flush = asyncio.create_task(self._flush_presence())
+    
+    async def _flush_presence(self):
+        await asyncio.sleep(self.presence_window)
+        before, self._presence_before = self._presence_before, {}
+        diffs: Dict[ClientConnection, Tuple[List[int], List[int]]] = {}
+        for user_id, was_online in before.items():
+            online = self.is_online(user_id)
+            if online == was_online:
+                continue
+            for connection in self.presence_watchers.get(user_id, ()):
+                diffs.setdefault(connection, ([], []))[0 if online else 1].append(user_id)
+        for connection, (online, offline) in diffs.items():
+            connection.push({"type": "presence", "online": online, "offline": offline})
     
     def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+        for connection in list(self.active_connections.get(user_id, [])):
+            if connection.websocket is websocket:
+                connection.detach()
         print(f"User {user_id} disconnected")
     
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            # Send to all connections of this user (multiple tabs/devices)
-            disconnected_connections = []
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except:
-                    # Connection is broken, mark for removal
-                    disconnected_connections.append(connection)
-            
-            # Remove broken connections
-            for conn in disconnected_connections:
-                self.active_connections[user_id].remove(conn)
-            
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-    
-    async def broadcast_to_users(self, message: dict, user_ids: List[int]):
+    def _enqueue_local(
+        self, message: dict, user_id: int, coalesce_key: Optional[str], encoded: Dict[str, object]
+    ):
+        # Send to all connections of this user (multiple tabs/devices); never waits.
+        # `encoded` caches the payload per codec for the whole fan-out. Room
+        # messages are numbered separately and not replayed, so only direct
+        # messages are deduped against reconnect replay
+        message_id = message.get("id") if "room_id" not in message else None
+        for connection in list(self.active_connections.get(user_id, [])):
+            codec = connection.codec
+            if codec.name not in encoded:
+                encoded[codec.name] = codec.encode(message)
+            connection.enqueue(encoded[codec.name], coalesce_key, message_id)
+    
+    async def _deliver_local(self, message: dict, user_ids: List[int]):
+        # Published by another worker; the coalesce key travels in the envelope
+        coalesce_key = message.pop("coalesce_key", None)
+        encoded = {}
         for user_id in user_ids:
-            await self.send_personal_message(message, user_id)
+            self._enqueue_local(message, user_id, coalesce_key, encoded)
+    
+    async def send_personal_message(
+        self, message: dict, user_id: int, coalesce_key: Optional[str] = None
+    ):
+        await self.broadcast_to_users(message, [user_id], coalesce_key)
+    
+    async def broadcast_to_users(
+        self, message: dict, user_ids: List[int], coalesce_key: Optional[str] = None
+    ):
+        await self._ensure_backend()
+        # Encode once per codec for the whole fan-out; each socket's writer task
+        # does the sending. Chat deliveries carry the message "id", which
+        # reconnect replay dedupes on
+        encoded = {}
+        for user_id in user_ids:
+            self._enqueue_local(message, user_id, coalesce_key, encoded)
+        
+        # The users may also have tabs/devices connected to other workers; one
+        # publish covers them all
+        if coalesce_key is not None:
+            message = {**message, "coalesce_key": coalesce_key}
+        await self.backend.publish(message, user_ids)
+    
+    async def send_many(self, deliveries: List[Tuple[dict, int]]):
+        """Fan out several (message, user_id) deliveries. Local queues are all
+        filled before anything awaits, so a binary client gets them in one frame"""
+        await self._ensure_backend()
+        for message, user_id in deliveries:
+            self._enqueue_local(message, user_id, None, {})
+        await asyncio.gather(*(self.backend.publish(message, [user_id]) for message, user_id in deliveries))
     
     def get_connected_users(self) -> List[int]:
+        """Users connected to this worker process"""
         return list(self.active_connections.keys())
+    
+    def stats(self) -> dict:
+        connections = [c for conns in self.active_connections.values() for c in conns]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(connections),
+            "queued": sum(c.backlog for c in connections),
+            "presence_subscriptions": sum(len(c.presence) for c in connections),
+            "policy": self.slow_consumer_policy,
+            **self.counters,
+        }
 
 
 # Global connection manager instance
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager(
+    create_backend(settings.ws_backend, settings.ws_bus_dir),
+    settings.ws_send_queue_size,
+    settings.ws_slow_consumer_policy,
+    settings.ws_send_timeout_seconds,
+    settings.ws_heartbeat_interval_seconds,
+    settings.ws_idle_timeout_seconds,
+    settings.presence_batch_window_ms / 1000
+)
@@ -0,0 +1,214 @@
+from collections import Counter, deque
+from typing import Callable, Deque, Hashable, List, Optional, Set, Tuple
+from fastapi import WebSocket
+from .protocol import DEFAULT_CODEC, Frame
+import asyncio
+import time
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# "Try Again Later": the client fell too far behind and should reconnect
+CLOSE_SLOW_CONSUMER = 1013
+# Sent too many messages too fast (mirrors HTTP 429)
+CLOSE_RATE_LIMITED = 4029
+# Silent past the idle timeout, pings included (mirrors HTTP 408)
+CLOSE_IDLE = 4408
+
+# Upper bound on queued items the binary protocol packs into one frame
+MAX_FRAME_ITEMS = 64
+
+# Socket closes started from enqueue, kept until done; the connection is
+# already unregistered by then, so nothing else holds them
+_closing: Set[asyncio.Task] = set()
+
+
+class ClientConnection:
+    """One WebSocket with a bounded outbound queue drained by its own writer task.
+
+    `enqueue` never waits, so fan-out never blocks on a slow client. When the
+    queue is full the policy decides what gives:
+
+    - drop_oldest: discard the oldest queued frame
+    - coalesce: replace a queued frame with the same coalesce key (e.g. the
+      latest typing or presence state), otherwise drop the oldest
+    - disconnect: close the socket so the client reconnects and catches up
+
+    A connection can start paused while missed messages are replayed from the
+    database (see `send_now` and `resume`). Live frames queue up meanwhile; if
+    that buffer overflows, `overflowed` tells the replay to read further
+    instead of applying the slow-consumer policy.
+
+    Items are queued already encoded by the connection's codec. The writer
+    sends each JSON item as its own text frame, while the binary codec packs
+    everything queued (up to MAX_FRAME_ITEMS) into one frame.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_queue: int,
+        policy: str,
+        send_timeout: float,
+        counters: Counter,
+        on_closed: Callable[["ClientConnection"], None],
+        codec=DEFAULT_CODEC
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.counters = counters
+        self.codec = codec
+        self.closed = False
+        self._on_closed = on_closed
+        self.paused = False
+        self.overflowed = False
+        # Newest message id the reconnect replay sent; live copies of those
+        # messages can still arrive after resume and are dropped
+        self.replayed_through = 0
+        # Heartbeat bookkeeping (monotonic): last inbound frame, last ping sent.
+        # Only used for clients that opted into app-level heartbeats
+        self.heartbeat = False
+        self.last_seen = time.monotonic()
+        self.last_ping = 0.0
+        # Users whose presence this connection subscribed to
+        self.presence: Set[int] = set()
+        # (encoded item, coalesce key, message id for chat deliveries)
+        self._queue: Deque[Tuple[Frame, Optional[Hashable], Optional[int]]] = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self, paused: bool = False):
+        self.paused = paused
+        self._writer = asyncio.create_task(self._run())
+
+    def touch(self):
+        """Record inbound activity; any frame from the client counts, not just pongs"""
+        self.last_seen = time.monotonic()
+
+    def push(
+        self, payload: dict, coalesce_key: Optional[Hashable] = None, message_id: Optional[int] = None
+    ) -> bool:
+        """Encode with this connection's codec and queue"""
+        return self.enqueue(self.codec.encode(payload), coalesce_key, message_id)
+
+    def enqueue(
+        self, item: Frame, coalesce_key: Optional[Hashable] = None, message_id: Optional[int] = None
+    ) -> bool:
+        """Queue an item encoded by `self.codec`; returns False if it was not queued"""
+        if self.closed:
+            return False
+        if message_id is not None and message_id <= self.replayed_through:
+            # Already sent by the replay
+            return True
+        
+        if self.paused and len(self._queue) >= self.max_queue:
+            # Replay in progress: the dropped message will be read from the database
+            self._queue.popleft()
+            self.overflowed = True
+        elif len(self._queue) >= self.max_queue:
+            if self.policy == DISCONNECT:
+                # Closed right away so further enqueues bail out above
+                self.counters["disconnected"] += 1
+                self._mark_closed()
+                task = asyncio.create_task(self._close_socket(CLOSE_SLOW_CONSUMER, "Client too slow"))
+                _closing.add(task)
+                task.add_done_callback(_closing.discard)
+                return False
+            if self.policy == COALESCE and coalesce_key is not None:
+                for index, entry in enumerate(self._queue):
+                    if entry[1] == coalesce_key:
+                        self._queue[index] = (item, coalesce_key, message_id)
+                        self.counters["coalesced"] += 1
+                        return True
+            self._queue.popleft()
+            self.counters["dropped"] += 1
+        
+        self._queue.append((item, coalesce_key, message_id))
+        self.counters["enqueued"] += 1
+        if not self.paused:
+            self._ready.set()
+        return True
+
+    async def send_now(self, payloads: List[dict]):
+        """Write directly while paused; the writer task is idle until `resume`"""
+        await self._send([self.codec.encode(payload) for payload in payloads])
+
+    def resume(self, replayed_through: int, notice: Optional[dict] = None):
+        """Switch to live delivery, dropping queued messages the replay already
+        sent, as well as any that are enqueued later. `notice` is written ahead
+        of the buffered live frames."""
+        self.replayed_through = replayed_through
+        self._queue = deque(
+            entry for entry in self._queue if entry[2] is None or entry[2] > replayed_through
+        )
+        if notice is not None:
+            self._queue.appendleft((self.codec.encode(notice), None, None))
+        self.paused = False
+        self.overflowed = False
+        self._ready.set()
+
+    @property
+    def backlog(self) -> int:
+        return len(self._queue)
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    if self.codec.binary:
+                        count = min(len(self._queue), MAX_FRAME_ITEMS)
+                    else:
+                        count = 1
+                    await self._send([self._queue.popleft()[0] for _ in range(count)])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Stalled past the timeout or the socket is gone
+            self.counters["send_errors"] += 1
+            print(f"Dropping connection for user {self.user_id}: {e!r}")
+            await self.close(CLOSE_SLOW_CONSUMER, "Send failed")
+
+    async def _send(self, items: List[Frame]):
+        if not items:
+            return
+        for frame in self.codec.join(items):
+            if self.codec.binary:
+                await asyncio.wait_for(self.websocket.send_bytes(frame), self.send_timeout)
+            else:
+                await asyncio.wait_for(self.websocket.send_text(frame), self.send_timeout)
+            self.counters["frames"] += 1
+        self.counters["sent"] += len(items)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        self._mark_closed()
+        await self._close_socket(code, reason)
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def _mark_closed(self):
+        self.closed = True
+        self._queue.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._on_closed(self)
+
+    def detach(self):
+        """Stop the writer after the client went away; pending frames are dropped"""
+        if not self.closed:
+            self._mark_closed()
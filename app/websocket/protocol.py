@@ -0,0 +1,74 @@
+from typing import List, Optional, Sequence, Tuple, Union
+import json
+import struct
+import msgpack
+
+# Clients opt into the binary protocol through Sec-WebSocket-Protocol; a
+# client that offers nothing gets the original one-JSON-object-per-frame protocol
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+JSON_SUBPROTOCOL = "chat.json.v1"
+
+Frame = Union[str, bytes]
+
+
+class JsonCodec:
+    """Text frames, one JSON object each"""
+
+    name = "json"
+    binary = False
+
+    def encode(self, payload: dict) -> str:
+        return json.dumps(payload)
+
+    def decode(self, data: str) -> List[dict]:
+        return [json.loads(data)]
+
+    def join(self, items: Sequence[str]) -> List[str]:
+        return list(items)
+
+
+class MsgpackCodec:
+    """Binary frames, each a MessagePack array of objects in both directions.
+
+    Items are packed once when queued; a frame of queued items is assembled
+    by prefixing their concatenation with an array header, without repacking.
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, payload: dict) -> bytes:
+        return msgpack.packb(payload)
+
+    def decode(self, data: bytes) -> List[dict]:
+        try:
+            payload = msgpack.unpackb(data)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+            raise ValueError(str(e))
+        return payload if isinstance(payload, list) else [payload]
+
+    def join(self, items: Sequence[bytes]) -> List[bytes]:
+        return [_array_header(len(items)) + b"".join(items)]
+
+
+def _array_header(length: int) -> bytes:
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 0x10000:
+        return b"\xdc" + struct.pack(">H", length)
+    return b"\xdd" + struct.pack(">I", length)
+
+
+CODECS = {
+    JSON_SUBPROTOCOL: JsonCodec(),
+    MSGPACK_SUBPROTOCOL: MsgpackCodec(),
+}
+DEFAULT_CODEC = CODECS[JSON_SUBPROTOCOL]
+
+
+def negotiate(offered: Sequence[str]) -> Tuple[Union[JsonCodec, MsgpackCodec], Optional[str]]:
+    """Pick the first subprotocol the client offered that we speak"""
+    for subprotocol in offered:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol], subprotocol
+    return DEFAULT_CODEC, None
@@ -0,0 +1,402 @@
+"""Load and latency benchmark against a local uvicorn server.
+
+Seeds a scratch SQLite database with N users and M messages, starts the app
+on localhost against it, and drives a weighted mix of HTTP operations from
+concurrent workers alongside a set of WebSocket clients. Reports throughput
+and p50/p95/p99 latency per operation as JSON, and can compare the run with
+a stored baseline, exiting non-zero on regressions.
+
+Run from the repository root:
+
+    python benchmarks/load.py --users 200 --messages 20000 --duration 20 \\
+        --mix login=1,send=10,conversation=10,upload=1,image=3 --ws-clients 20 \\
+        --output results.json --baseline benchmarks/baseline.json
+
+Use --save-baseline PATH to record a new baseline. Baselines are machine
+specific; regenerate one on the machine that runs the comparison.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchmark-password"
+OPERATIONS = ("login", "send", "conversation", "upload", "image")
+DEFAULT_MIX = "login=1,send=10,conversation=10,upload=1,image=3"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {OPERATIONS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.finished = time.monotonic()
+
+    def record(self, operation: str, seconds: float, error: Optional[str] = None):
+        self.finished = time.monotonic()
+        if error is None:
+            self.latencies.setdefault(operation, []).append(seconds)
+        else:
+            errors = self.errors.setdefault(operation, {})
+            errors[error] = errors.get(error, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, dict]:
+        results = {}
+        for operation in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(operation, []))
+            results[operation] = {
+                "count": len(values),
+                "errors": self.errors.get(operation, {}),
+                "throughput_rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return results
+
+
+def seed(database_url: str, users: int, messages: int, bcrypt_rounds: int, seed: int):
+    """Bulk-insert users and messages in a child process, so the app modules
+    pick up the scratch database settings"""
+    script = f"""
+import random, sys
+sys.path.insert(0, {ROOT!r})
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from app.core.database import engine
+from app.core.migrations import ensure_schema
+from app.core.security import get_password_hash
+from app.models.message import Message, MessageType
+from app.models.user import User
+
+ensure_schema(engine, auto_upgrade=True)
+hashed = get_password_hash({PASSWORD!r})
+with engine.begin() as connection:
+    connection.execute(insert(User), [
+        {{"username": f"user{{i}}", "email": f"user{{i}}@example.com", "hashed_password": hashed}}
+        for i in range(1, {users} + 1)
+    ])
+    rng = random.Random({seed})
+    pairs = [(rng.randint(1, {users}), rng.randint(1, {users})) for _ in range({messages})]
+    start = datetime(2024, 1, 1)
+    for offset in range(0, len(pairs), 10000):
+        connection.execute(insert(Message), [
+            {{
+                "sender_id": sender,
+                "receiver_id": receiver if receiver != sender else sender % {users} + 1,
+                "content": f"Seeded message {{offset + i}}",
+                "message_type": MessageType.TEXT,
+                "created_at": start + timedelta(seconds=offset + i),
+            }}
+            for i, (sender, receiver) in enumerate(pairs[offset:offset + 10000])
+        ])
+"""
+    env = {**os.environ, "DATABASE_URL": database_url, "BCRYPT_ROUNDS": str(bcrypt_rounds)}
+    subprocess.run([sys.executable, "-c", script], check=True, env=env, cwd=ROOT)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, env: Dict[str, str], log) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        # Own process group, so stopping it also reaps executor workers
+        start_new_session=True,
+    )
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+    # Forked pool workers inherit uvicorn's signal handlers and ignore SIGTERM
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit("Server exited during startup")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not become ready")
+
+
+def make_images(count: int, rng: random.Random) -> List[bytes]:
+    from PIL import Image
+
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (256, 256), tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, users: int, tokens: Dict[int, str],
+                 images: List[bytes], rng: random.Random):
+        self.client = client
+        self.users = users
+        self.tokens = tokens
+        self.images = images
+        self.rng = rng
+        # (sender_id, message_id) of uploaded images
+        self.image_ids: List[Tuple[int, int]] = []
+
+    def _pair(self):
+        sender = self.rng.choice(list(self.tokens))
+        receiver = self.rng.randint(1, self.users)
+        if receiver == sender:
+            receiver = sender % self.users + 1
+        return sender, receiver, {"Authorization": f"Bearer {self.tokens[sender]}"}
+
+    async def login(self):
+        user_id = self.rng.randint(1, self.users)
+        return await self.client.post(
+            "/auth/login", json={"username": f"user{user_id}", "password": PASSWORD}
+        )
+
+    async def send(self):
+        _, receiver, headers = self._pair()
+        return await self.client.post(
+            "/messages/send", json={"receiver_id": receiver, "content": "benchmark"}, headers=headers
+        )
+
+    async def conversation(self):
+        _, other, headers = self._pair()
+        return await self.client.get(f"/messages/conversation/{other}?limit=50", headers=headers)
+
+    async def upload(self):
+        _, receiver, headers = self._pair()
+        response = await self.client.post(
+            "/messages/send-image",
+            data={"receiver_id": str(receiver)},
+            files={"file": ("bench.png", self.rng.choice(self.images), "image/png")},
+            headers=headers,
+        )
+        if response.status_code == 200:
+            body = response.json()
+            self.image_ids.append((body["sender_id"], body["id"]))
+        return response
+
+    async def image(self):
+        if not self.image_ids:
+            return await self.upload()
+        sender, message_id = self.rng.choice(self.image_ids)
+        headers = {"Authorization": f"Bearer {self.tokens[sender]}"}
+        size = self.rng.choice((64, 128, 256))
+        return await self.client.get(f"/messages/image/{message_id}?w={size}&h={size}", headers=headers)
+
+
+async def http_worker(workload: Workload, mix: Dict[str, float], recorder: Recorder, deadline: float):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        operation = workload.rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            response = await getattr(workload, operation)()
+            error = None if response.status_code < 400 else str(response.status_code)
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        recorder.record(operation, time.perf_counter() - started, error)
+
+
+async def ws_client(ws_url: str, token: str, receiver: int, recorder: Recorder, deadline: float):
+    """Send a message, wait for its ack, repeat; records ack round-trip latency"""
+    try:
+        async with websockets.connect(f"{ws_url}?token={token}", close_timeout=1) as websocket:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                await websocket.send(json.dumps({"receiver_id": receiver, "message": "benchmark"}))
+                while True:
+                    # Skip deliveries from other clients until our ack arrives
+                    frame = json.loads(await websocket.recv())
+                    if "status" in frame or "error" in frame:
+                        break
+                recorder.record("ws_send", time.perf_counter() - started, frame.get("error"))
+    except (OSError, websockets.WebSocketException) as e:
+        recorder.record("ws_send", 0, type(e).__name__)
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    database_url = f"sqlite:///{workdir}/bench.db"
+    seed(database_url, args.users, args.messages, args.bcrypt_rounds, args.seed)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log_path = os.path.join(workdir, "server.log")
+    print(f"Server log: {log_path}", file=sys.stderr)
+    log = open(log_path, "w")
+    server = start_server(port, {
+        "DATABASE_URL": database_url,
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "THUMBNAIL_CACHE_DIR": os.path.join(workdir, "thumbnails"),
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "WS_BACKEND": "memory",
+        # Measure the service, not the per-user send budget
+        "SEND_RATE_PER_SECOND": "0",
+    }, log)
+    try:
+        await wait_until_ready(base_url, server)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            tokens = {}
+            for user_id in rng.sample(range(1, args.users + 1), min(args.users, args.active_users)):
+                response = await client.post(
+                    "/auth/login", json={"username": f"user{user_id}", "password": PASSWORD}
+                )
+                response.raise_for_status()
+                tokens[user_id] = response.json()["access_token"]
+
+            workload = Workload(client, args.users, tokens, make_images(8, rng), rng)
+            recorder = Recorder()
+            started = time.monotonic()
+            deadline = started + args.duration
+            tasks = [
+                http_worker(workload, args.mix, recorder, deadline) for _ in range(args.concurrency)
+            ]
+            ws_url = f"ws://127.0.0.1:{port}/ws/chat"
+            for _ in range(args.ws_clients):
+                sender, receiver, _ = workload._pair()
+                tasks.append(ws_client(ws_url, tokens[sender], receiver, recorder, deadline))
+            await asyncio.gather(*tasks)
+            # Closing connections isn't part of the measured window
+            elapsed = recorder.finished - started
+    finally:
+        stop_server(server)
+        log.close()
+
+    results = recorder.summary(elapsed)
+    return {
+        "config": {
+            "users": args.users,
+            "messages": args.messages,
+            "active_users": len(tokens),
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "ws_clients": args.ws_clients,
+            "mix": args.mix,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "seed": args.seed,
+        },
+        "results": results,
+        "total_throughput_rps": round(sum(r["count"] for r in results.values()) / elapsed, 2),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions: p95 latency above, or throughput below, the baseline by
+    more than `tolerance` (a fraction)"""
+    regressions = []
+    if report["config"] != baseline["config"]:
+        regressions.append("configuration differs from the baseline; results are not comparable")
+    for operation, expected in baseline["results"].items():
+        actual = report["results"].get(operation)
+        if actual is None:
+            regressions.append(f"{operation}: missing from this run")
+            continue
+        if actual["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{operation}: p95 {actual['p95_ms']}ms vs baseline {expected['p95_ms']}ms"
+            )
+        if actual["throughput_rps"] < expected["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{operation}: {actual['throughput_rps']} rps vs baseline {expected['throughput_rps']} rps"
+            )
+        if sum(actual["errors"].values()) > sum(expected["errors"].values()) * (1 + tolerance):
+            regressions.append(f"{operation}: errors {actual['errors']} vs baseline {expected['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--active-users", type=int, default=50, help="users that log in and send")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent HTTP workers")
+    parser.add_argument("--ws-clients", type=int, default=20)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="keep low unless benchmarking password hashing itself")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here as well as stdout")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", help="write this run as the new baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:", *regressions, sep="\n  ", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
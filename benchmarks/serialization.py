@@ -0,0 +1,111 @@
+"""Compare message list serialization paths at 1k, 10k and 100k messages.
+
+"orm" is the previous implementation: ORM objects validated through
+response_model=List[MessageResponse] and encoded by FastAPI. "rows" is
+GET /messages/my-messages as it ships now: MESSAGE_COLUMNS rows encoded
+straight to JSON bytes. Both go through the real FastAPI stack, so timings
+include the query, serialization and the HTTP round trip in TestClient.
+
+Run from the repository root:
+
+    python benchmarks/serialization.py [--sizes 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before anything imports the settings
+_workdir = tempfile.mkdtemp(prefix="bench-serialization-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_workdir}/bench.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing import List
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+from app.api import messages
+from app.api.dependencies import get_current_user
+from app.core.database import Base, SessionLocal, engine, get_db
+from app.models.message import Message, MessageType
+from app.models.user import User
+from app.schemas.message import MessageResponse
+from app.services.message_service import MessageService
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(messages.router)
+
+    @app.get("/baseline/my-messages", response_model=List[MessageResponse])
+    def baseline(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+    ):
+        return MessageService.get_user_messages(db, current_user.id)
+
+    with SessionLocal() as db:
+        user = db.get(User, 1)
+        db.expunge(user)
+    app.dependency_overrides[get_current_user] = lambda: user
+    return app
+
+
+def seed(count: int):
+    with engine.begin() as connection:
+        connection.execute(delete(Message))
+        start = datetime(2024, 1, 1)
+        connection.execute(insert(Message), [
+            {
+                "sender_id": 1 + i % 2,
+                "receiver_id": 2 - i % 2,
+                "content": f"Message number {i} with a little text in it",
+                "message_type": MessageType.TEXT,
+                "created_at": start + timedelta(seconds=i),
+            }
+            for i in range(count)
+        ])
+
+
+def measure(client: TestClient, url: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"id": 1, "username": "alice", "email": "alice@example.com", "hashed_password": "-"},
+            {"id": 2, "username": "bob", "email": "bob@example.com", "hashed_password": "-"},
+        ])
+    client = TestClient(build_app())
+
+    print(f"{'messages':>10} {'orm (ms)':>10} {'rows (ms)':>10} {'speedup':>8}")
+    for size in args.sizes:
+        seed(size)
+        baseline = client.get("/baseline/my-messages").json()
+        if client.get("/messages/my-messages").json() != baseline:
+            raise SystemExit(f"Responses differ at {size} messages")
+
+        orm = measure(client, "/baseline/my-messages", args.repeat)
+        rows = measure(client, "/messages/my-messages", args.repeat)
+        print(f"{size:>10} {orm * 1000:>10.1f} {rows * 1000:>10.1f} {orm / rows:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,88 @@
-from fastapi import FastAPI, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-from app.core.database import engine, get_db
-from app.models import user, message  # Import models to create tables
-from app.api import auth, messages
+from app.core.config import settings
+from app.core.database import (
+    engine, async_engine, read_engine, async_read_engine, get_db, warm_pool, warm_async_pool
+)
+from app.core.metrics import (
+    MetricsMiddleware, StartupTimer, register_collector, pool_metrics, websocket_metrics
+)
+from app.core.migrations import ensure_schema
+from app.models import user, message, conversation, media, room  # Register models on Base.metadata
+from app.services.auth_service import user_cache
+from app.services.thumbnail_service import thumbnail_cache
+from app.core.security import token_cache, password_hasher, warm_up_tokens
+from app.api import auth, messages, rooms
 from app.websocket.chat import websocket_endpoint
+from app.websocket.connection_manager import manager
+from app.api.dependencies import send_limiter
+from app.core.rate_limit import in_flight_limiters
+from app.services.message_writer import message_writer
+from app.services.receipt_writer import receipt_writer, room_receipt_writer
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import asyncio
 import os
 
-# Create database tables
-user.Base.metadata.create_all(bind=engine)
-message.Base.metadata.create_all(bind=engine)
+startup = StartupTimer()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each phase is timed, so slow worker boots show up in the log and /health
+    with startup.phase("schema"):
+        print(f"Database schema {await asyncio.to_thread(ensure_schema, engine, settings.db_auto_migrate)}")
+    
+    with startup.phase("directories"):
+        for directory in ("uploads", settings.upload_dir, settings.thumbnail_cache_dir):
+            os.makedirs(directory, exist_ok=True)
+    
+    # Independent warm-ups overlap; each is still timed on its own
+    await asyncio.gather(
+        startup.timed("executors", asyncio.gather(
+            password_hasher.warm_up(),
+            thumbnail_cache.warm_up(),
+        )),
+        startup.timed("db_pools", asyncio.gather(
+            asyncio.to_thread(warm_pool, engine),
+            asyncio.to_thread(warm_pool, read_engine),
+            warm_async_pool(async_engine),
+            warm_async_pool(async_read_engine),
+        )),
+    )
+    
+    with startup.phase("tokens"):
+        warm_up_tokens()
+    
+    with startup.phase("background_tasks"):
+        message_writer.start()
+        receipt_writer.start()
+        room_receipt_writer.start()
+        await manager.start()
+    
+    startup.finish()
+    yield
+    
+    # Queued messages and pending receipts are committed (and pushed) before
+    # the backend goes away
+    await message_writer.stop()
+    await receipt_writer.stop()
+    await room_receipt_writer.stop()
+    await manager.stop()
+    password_hasher.shutdown()
+    thumbnail_cache.shutdown()
+    await asyncio.gather(async_engine.dispose(), async_read_engine.dispose())
+    engine.dispose()
+    read_engine.dispose()
+
 
 app = FastAPI(
     title="Social Media Backend API",
     description="A FastAPI backend for social media platform with chat functionality",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -27,15 +94,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create uploads directory
-os.makedirs("uploads", exist_ok=True)
+# Route latency and per-request DB stats for /metrics
+app.add_middleware(MetricsMiddleware)
+register_collector(lambda: (
+    pool_metrics({
+        "sync": engine,
+        "async": async_engine.sync_engine,
+        "sync_read": read_engine,
+        "async_read": async_read_engine.sync_engine,
+    })
+    + websocket_metrics(manager.stats())
+))
 
-# Mount static files for serving uploaded images
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Mount static files for serving uploaded images (the lifespan creates the directory)
+app.mount("/uploads", StaticFiles(directory="uploads", check_dir=False), name="uploads")
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(messages.router)
+app.include_router(rooms.router)
 
 # WebSocket endpoint
 app.websocket("/ws/chat")(websocket_endpoint)
@@ -55,9 +132,28 @@ def read_root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "startup": startup.report(),
+        "caches": {"tokens": token_cache.stats(), "users": user_cache.stats()},
+        "password_hasher": password_hasher.stats(),
+        "websockets": manager.stats(),
+        "receipts": receipt_writer.stats(),
+        "room_receipts": room_receipt_writer.stats(),
+        "admission": {
+            "send_rate": send_limiter.stats(),
+            "in_flight": {name: limiter.stats() for name, limiter in in_flight_limiters.items()},
+            "message_writer_rejected": message_writer.rejected
+        }
+    }
 
 
 if __name__ == "__main__":
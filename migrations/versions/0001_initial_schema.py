@@ -0,0 +1,239 @@
+"""Initial schema
+
+Baseline for databases that used to be built by create_all at import time.
+Every step checks what already exists, so upgrading an older database only
+adds the tables, indexes and search index it is missing (the same work the
+old startup code repeated on every boot).
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+MESSAGE_TYPES = ("TEXT", "IMAGE", "VIDEO", "AUDIO", "FILE")
+PREVIEW_LENGTH = 100
+
+# Full-text search as of this revision, frozen here so later changes to the
+# search code can't alter what the baseline does.
+#
+# SQLite: an external-content FTS5 index over a view of messages, kept in sync
+# by triggers. The view adds a `participants` column ("u<sender> u<receiver>")
+# so restricting results to the caller's conversations happens inside the
+# inverted index rather than by filtering every match afterwards.
+SEARCH_SQLITE_DDL = [
+    """CREATE VIEW IF NOT EXISTS messages_fts_source AS
+       SELECT id, content, 'u' || sender_id || ' u' || receiver_id AS participants
+       FROM messages""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+       content, participants,
+       content='messages_fts_source', content_rowid='id',
+       tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+       WHEN new.content IS NOT NULL BEGIN
+         INSERT INTO messages_fts(rowid, content, participants)
+         VALUES (new.id, new.content, 'u' || new.sender_id || ' u' || new.receiver_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+       WHEN old.content IS NOT NULL BEGIN
+         INSERT INTO messages_fts(messages_fts, rowid, content, participants)
+         VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.receiver_id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update
+       AFTER UPDATE OF content, sender_id, receiver_id ON messages BEGIN
+         INSERT INTO messages_fts(messages_fts, rowid, content, participants)
+         SELECT 'delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.receiver_id
+         WHERE old.content IS NOT NULL;
+         INSERT INTO messages_fts(rowid, content, participants)
+         SELECT new.id, new.content, 'u' || new.sender_id || ' u' || new.receiver_id
+         WHERE new.content IS NOT NULL;
+       END""",
+]
+
+# PostgreSQL: a generated tsvector column with a GIN index; the database keeps
+# it in sync on every write
+SEARCH_POSTGRES_DDL = [
+    """ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+       GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING gin (content_tsv)",
+]
+
+
+def _pair(bind, a, b):
+    """(lower, higher) of two ids, spelled as the models' least/greatest
+    compile: SQLite has no LEAST/GREATEST, but its multi-argument min/max are scalar"""
+    if bind.dialect.name == "sqlite":
+        return sa.func.min(a, b), sa.func.max(a, b)
+    return sa.func.least(a, b), sa.func.greatest(a, b)
+
+
+def _message_type(create_type: bool = True):
+    if create_type:
+        return sa.Enum(*MESSAGE_TYPES, name="messagetype")
+    # Shared with messages.message_type; PostgreSQL must not create the type twice
+    return sa.Enum(*MESSAGE_TYPES, name="messagetype").with_variant(
+        postgresql.ENUM(*MESSAGE_TYPES, name="messagetype", create_type=False), "postgresql"
+    )
+
+
+def _backfill_conversations(bind):
+    """Inbox rows for conversations that predate the conversations table"""
+    messages = sa.table(
+        "messages",
+        sa.column("id", sa.Integer),
+        sa.column("sender_id", sa.Integer),
+        sa.column("receiver_id", sa.Integer),
+        sa.column("content", sa.Text),
+        sa.column("message_type", sa.String),
+        sa.column("created_at", sa.DateTime),
+    )
+    conversations = sa.table(
+        "conversations",
+        *(sa.column(name) for name in (
+            "user_low_id", "user_high_id", "last_message_id", "last_sender_id", "last_message_type",
+            "last_message_preview", "last_message_at", "unread_low", "unread_high"
+        ))
+    )
+    if bind.execute(sa.select(sa.literal(1)).select_from(conversations).limit(1)).first() is not None:
+        return
+
+    low, high = _pair(bind, messages.c.sender_id, messages.c.receiver_id)
+    last_ids = sa.select(sa.func.max(messages.c.id)).group_by(low, high)
+    # Same text as ConversationService._preview; enum names are stored upper case
+    message_type = sa.cast(messages.c.message_type, sa.String)
+    preview = sa.case(
+        (messages.c.content.isnot(None) & (messages.c.content != ""),
+         sa.func.substr(messages.c.content, 1, PREVIEW_LENGTH)),
+        (message_type != "TEXT", "[" + sa.func.lower(message_type) + "]"),
+        else_=None
+    )
+    bind.execute(conversations.insert().from_select(
+        [
+            "user_low_id", "user_high_id", "last_message_id", "last_sender_id", "last_message_type",
+            "last_message_preview", "last_message_at", "unread_low", "unread_high"
+        ],
+        sa.select(
+            low, high, messages.c.id, messages.c.sender_id, messages.c.message_type,
+            preview, messages.c.created_at, sa.literal(0), sa.literal(0)
+        ).where(messages.c.id.in_(last_ids))
+    ))
+
+
+def _install_search(bind):
+    """Full-text index over message content (FTS5 on SQLite, tsvector on
+    PostgreSQL); a new SQLite index is built from the existing messages"""
+    if bind.dialect.name == "sqlite":
+        exists = bind.execute(sa.text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        )).first() is not None
+        for statement in SEARCH_SQLITE_DDL:
+            bind.execute(sa.text(statement))
+        if not exists:
+            bind.execute(sa.text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    elif bind.dialect.name == "postgresql":
+        for statement in SEARCH_POSTGRES_DDL:
+            bind.execute(sa.text(statement))
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {bind.dialect.name}")
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("username", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("hashed_password", sa.String(), nullable=False),
+            sa.Column("full_name", sa.String(), nullable=True),
+            sa.Column("is_active", sa.Boolean(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "media_blobs" not in tables:
+        op.create_table(
+            "media_blobs",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("sha256", sa.String(length=64), nullable=False),
+            sa.Column("path", sa.String(), nullable=False),
+            sa.Column("size", sa.Integer(), nullable=False),
+            sa.Column("content_type", sa.String(), nullable=True),
+            sa.Column("ref_count", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("path"),
+        )
+        op.create_index("ix_media_blobs_id", "media_blobs", ["id"])
+        op.create_index("ix_media_blobs_sha256", "media_blobs", ["sha256"], unique=True)
+
+    if "messages" not in tables:
+        op.create_table(
+            "messages",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("sender_id", sa.Integer(), nullable=False),
+            sa.Column("receiver_id", sa.Integer(), nullable=False),
+            sa.Column("content", sa.Text(), nullable=True),
+            sa.Column("message_type", _message_type(), nullable=True),
+            sa.Column("file_url", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.ForeignKeyConstraint(["sender_id"], ["users.id"]),
+            sa.ForeignKeyConstraint(["receiver_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_messages_id", "messages", ["id"])
+
+    # Indexes added to messages after the table first shipped (SQLite can't
+    # reflect expression indexes, hence IF NOT EXISTS rather than inspection)
+    op.create_index("ix_messages_conversation", "messages", [
+        *_pair(bind, sa.column("sender_id"), sa.column("receiver_id")),
+        sa.column("created_at"),
+        sa.column("id"),
+    ], if_not_exists=True)
+    op.create_index("ix_messages_receiver_id_id", "messages", ["receiver_id", "id"], if_not_exists=True)
+
+    if "conversations" not in tables:
+        op.create_table(
+            "conversations",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_low_id", sa.Integer(), nullable=False),
+            sa.Column("user_high_id", sa.Integer(), nullable=False),
+            sa.Column("last_message_id", sa.Integer(), nullable=False),
+            sa.Column("last_sender_id", sa.Integer(), nullable=False),
+            sa.Column("last_message_type", _message_type(create_type=False), nullable=True),
+            sa.Column("last_message_preview", sa.String(), nullable=True),
+            sa.Column("last_message_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("unread_low", sa.Integer(), nullable=False),
+            sa.Column("unread_high", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["user_low_id"], ["users.id"]),
+            sa.ForeignKeyConstraint(["user_high_id"], ["users.id"]),
+            sa.ForeignKeyConstraint(["last_message_id"], ["messages.id"]),
+            sa.ForeignKeyConstraint(["last_sender_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("user_low_id", "user_high_id", name="uq_conversations_pair"),
+        )
+        op.create_index("ix_conversations_id", "conversations", ["id"])
+        op.create_index("ix_conversations_low_recent", "conversations", ["user_low_id", "last_message_id"])
+        op.create_index("ix_conversations_high_recent", "conversations", ["user_high_id", "last_message_id"])
+    _backfill_conversations(bind)
+
+    _install_search(bind)
+
+
+def downgrade():
+    raise NotImplementedError("The baseline revision can't be downgraded")
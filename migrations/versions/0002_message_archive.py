@@ -0,0 +1,100 @@
+"""Message archive tier
+
+Adds messages_archive, the cold tier that the archival job moves old messages
+into, and widens full-text search to cover both tiers.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+MESSAGE_TYPES = ("TEXT", "IMAGE", "VIDEO", "AUDIO", "FILE")
+
+# SQLite: the FTS5 source view covers both tiers. Archiving copies a message
+# before deleting it from `messages`, so the hot tier's delete trigger keeps
+# the index entry of an archived copy; the archive drops it on its own delete.
+# The index itself (messages_fts) and its insert/update triggers are unchanged
+SEARCH_SQLITE_DDL = [
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    "DROP VIEW IF EXISTS messages_fts_source",
+    """CREATE VIEW messages_fts_source AS
+       SELECT id, content, 'u' || sender_id || ' u' || receiver_id AS participants
+       FROM messages
+       UNION ALL
+       SELECT id, content, 'u' || sender_id || ' u' || receiver_id AS participants
+       FROM messages_archive""",
+    """CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+       WHEN old.content IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM messages_archive WHERE id = old.id) BEGIN
+         INSERT INTO messages_fts(messages_fts, rowid, content, participants)
+         VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.receiver_id);
+       END""",
+    """CREATE TRIGGER messages_archive_fts_delete AFTER DELETE ON messages_archive
+       WHEN old.content IS NOT NULL BEGIN
+         INSERT INTO messages_fts(messages_fts, rowid, content, participants)
+         VALUES ('delete', old.id, old.content, 'u' || old.sender_id || ' u' || old.receiver_id);
+       END""",
+]
+
+# PostgreSQL: the archive gets the same generated tsvector column and GIN index
+SEARCH_POSTGRES_DDL = [
+    """ALTER TABLE messages_archive ADD COLUMN content_tsv tsvector
+       GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED""",
+    "CREATE INDEX ix_messages_archive_content_tsv ON messages_archive USING gin (content_tsv)",
+]
+
+
+def upgrade():
+    # Shares the messagetype enum created with messages
+    message_type = sa.Enum(*MESSAGE_TYPES, name="messagetype").with_variant(
+        postgresql.ENUM(*MESSAGE_TYPES, name="messagetype", create_type=False), "postgresql"
+    )
+    op.create_table(
+        "messages_archive",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("receiver_id", sa.Integer(), nullable=False),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("message_type", message_type, nullable=True),
+        sa.Column("file_url", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["sender_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["receiver_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    # Ordered pair as the models' least/greatest compile (min/max on SQLite)
+    sender_id, receiver_id = sa.column("sender_id"), sa.column("receiver_id")
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        pair = [sa.func.min(sender_id, receiver_id), sa.func.max(sender_id, receiver_id)]
+    else:
+        pair = [sa.func.least(sender_id, receiver_id), sa.func.greatest(sender_id, receiver_id)]
+    op.create_index("ix_messages_archive_conversation", "messages_archive", [
+        *pair,
+        sa.column("created_at"),
+        sa.column("id"),
+    ])
+    op.create_index("ix_messages_archive_receiver_id_id", "messages_archive", ["receiver_id", "id"])
+
+    # Frozen here rather than taken from SearchService, so later changes to
+    # the search schema can't alter what this revision does
+    if dialect == "sqlite":
+        statements = SEARCH_SQLITE_DDL
+    elif dialect == "postgresql":
+        statements = SEARCH_POSTGRES_DDL
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    raise NotImplementedError("Archived messages can't be moved back by a downgrade")
@@ -0,0 +1,42 @@
+"""Conversation receipts
+
+Per-participant read and delivered high-water marks on conversations. A side
+with nothing unread starts with both marks at the newest message.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+MARKS = ("read_low_id", "read_high_id", "delivered_low_id", "delivered_high_id")
+
+
+def upgrade():
+    with op.batch_alter_table("conversations") as batch:
+        for name in MARKS:
+            batch.add_column(sa.Column(name, sa.Integer(), nullable=False, server_default="0"))
+
+    conversations = sa.table(
+        "conversations",
+        *(sa.column(name, sa.Integer) for name in ("last_message_id", "unread_low", "unread_high") + MARKS)
+    )
+    c = conversations.c
+    for side in ("low", "high"):
+        op.execute(
+            conversations.update()
+            .where(c[f"unread_{side}"] == 0)
+            .values({c[f"read_{side}_id"]: c.last_message_id, c[f"delivered_{side}_id"]: c.last_message_id})
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("conversations") as batch:
+        for name in MARKS:
+            batch.drop_column(name)
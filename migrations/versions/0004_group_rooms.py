@@ -0,0 +1,71 @@
+"""Group rooms
+
+Rooms, their members (with per-member delivery marks) and room messages.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+MESSAGE_TYPES = ("TEXT", "IMAGE", "VIDEO", "AUDIO", "FILE")
+
+
+def upgrade():
+    op.create_table(
+        "rooms",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("created_by", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("last_message_id", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["created_by"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_rooms_id", "rooms", ["id"])
+
+    op.create_table(
+        "room_members",
+        sa.Column("room_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("joined_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("unread", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("read_up_to_id", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("delivered_up_to_id", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["room_id"], ["rooms.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("room_id", "user_id"),
+    )
+    op.create_index("ix_room_members_user_id", "room_members", ["user_id", "room_id"])
+
+    # Shares the messagetype enum created with messages
+    message_type = sa.Enum(*MESSAGE_TYPES, name="messagetype").with_variant(
+        postgresql.ENUM(*MESSAGE_TYPES, name="messagetype", create_type=False), "postgresql"
+    )
+    op.create_table(
+        "room_messages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("room_id", sa.Integer(), nullable=False),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("message_type", message_type, nullable=True),
+        sa.Column("file_url", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(["room_id"], ["rooms.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["sender_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_room_messages_room_id_id", "room_messages", ["room_id", "id"])
+
+
+def downgrade():
+    op.drop_table("room_messages")
+    op.drop_table("room_members")
+    op.drop_table("rooms")
@@ -88,7 +88,7 @@ def test_user_registration_and_messaging():
     response = requests.get(f"{BASE_URL}/messages/conversation/{user1['id']}", headers=headers)
     
     if response.status_code == 200:
-        messages = response.json()
+        messages = response.json()["items"]
         print(f"Found {len(messages)} messages in conversation:")
         for msg in messages:
             sender = "Alice" if msg["sender_id"] == user1["id"] else "Bob"
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from app.core.database import Base
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageType
+from app.models.user import User
+from app.schemas.message import MessageCreate
+from app.services.archive_service import ArchiveService
+from app.services.conversation_service import ConversationService
+from app.services.message_service import MessageService
+
+
+def test_read_receipt_counts_archived_messages(tmp_path):
+    """A read mark inside archived history leaves the archived messages after
+    it unread, not just the hot ones"""
+    path = tmp_path / "receipts.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as db:
+        db.add_all([
+            User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+            User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+        ])
+        db.commit()
+        ids = [
+            MessageService.create_message(
+                db, MessageCreate(receiver_id=2, content=f"message {i}", message_type=MessageType.TEXT), 1
+            ).id
+            for i in range(5)
+        ]
+        db.execute(update(Message).values(created_at=datetime.now(timezone.utc) - timedelta(days=30)))
+        db.commit()
+        # Everything but the conversation's latest message moves to the archive
+        moved = ArchiveService.archive_messages(db, datetime.now(timezone.utc) - timedelta(days=1))
+        assert moved == 4
+
+    async def read_up_to(message_id):
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        try:
+            async with AsyncSession(async_engine) as db:
+                return await ConversationService.apply_receipts_async(db, [(2, 1, message_id, 0)])
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(read_up_to(ids[1])) == [(2, 1, ids[1], ids[1])]
+    with Session(engine) as db:
+        conversation = db.query(Conversation).one()
+        # Two archived messages and the hot one are still unread
+        assert conversation.unread_high == 3
+
+    asyncio.run(read_up_to(ids[3]))
+    with Session(engine) as db:
+        assert db.query(Conversation).one().unread_high == 1
+    engine.dispose()